@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing
+import pandas as pd
+
+
+class AttendanceStore:
+    """Primary attendance records of the classes, kept in a SQLite database next to the Excel file.
+    Every run appends one day's statuses, and the Excel workbook is exported from it."""
+    schema = """
+        CREATE TABLE IF NOT EXISTS students (
+            class_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (class_id, name)
+        );
+        CREATE TABLE IF NOT EXISTS attendance (
+            class_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT,
+            PRIMARY KEY (class_id, day, name)
+        );
+    """
+
+    # Classes usually share one workbook with a sheet each, exports to the same workbook take turns
+    _export_locks = {}
+    _export_locks_guard = threading.Lock()
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with closing(self.connect()) as connection, connection:
+            connection.executescript(self.schema)
+
+    @classmethod
+    def for_excel_file(cls, excel_file_path):
+        """Returns the store kept next to the given Excel file, e.g. 'class attendance.sqlite'."""
+        return cls(os.path.splitext(excel_file_path)[0] + ".sqlite")
+
+    def connect(self):
+        # A fresh connection per operation, so the store can be used from several threads
+        return sqlite3.connect(self.store_path, timeout=30)
+
+    def has_class(self, class_id):
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT 1 FROM students WHERE class_id = ? LIMIT 1", (class_id,)).fetchone()
+        return row is not None
+
+    def students(self, class_id):
+        """Returns the students of the class in their original order."""
+        with closing(self.connect()) as connection:
+            rows = connection.execute("SELECT name FROM students WHERE class_id = ? ORDER BY position", (class_id,))
+            return [name for name, in rows]
+
+    def add_students(self, class_id, names):
+        """Adds the students not yet in the class, after the existing ones."""
+        with closing(self.connect()) as connection, connection:
+            position = connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM students WHERE class_id = ?",
+                                          (class_id,)).fetchone()[0]
+            for offset, name in enumerate(names):
+                connection.execute("INSERT OR IGNORE INTO students (class_id, name, position) VALUES (?, ?, ?)",
+                                   (class_id, str(name), position + offset))
+
+    def import_dataframe(self, class_id, df):
+        """One-off migration of an existing attendance sheet (students x dates) into the store."""
+        self.add_students(class_id, list(df.index))
+        rows = [(class_id, str(name), str(day), None if pd.isna(status) else str(status))
+                for day in df.columns for name, status in df[day].items()]
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO attendance (class_id, name, day, status) VALUES (?, ?, ?, ?)",
+                                   rows)
+
+    def record(self, class_id, day, results):
+        """Writes one day's statuses for every student of the class, absent unless found in results.
+        Students of the results the class doesn't have yet, enrolled since, are added after the others."""
+        # Roster names come from the pictures and may differ from the sheet in letter case only
+        statuses = {name.lower(): status for name, status in results.items()}
+        students = self.students(class_id)
+        known = {name.lower() for name in students}
+        new_students = [name for name in results if name.lower() not in known]
+        if new_students:
+            self.add_students(class_id, new_students)
+            students += new_students
+        rows = [(class_id, name, day, statuses.get(name.lower(), '✗')) for name in students]
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO attendance (class_id, name, day, status) VALUES (?, ?, ?, ?)",
+                                   rows)
+
+    def statuses(self, class_id, day):
+        """Returns the statuses recorded for the class on the given day, by student."""
+        with closing(self.connect()) as connection:
+            rows = connection.execute("SELECT name, status FROM attendance WHERE class_id = ? AND day = ?",
+                                      (class_id, day))
+            return dict(rows.fetchall())
+
+    def to_dataframe(self, class_id):
+        """Returns the attendance of the class as a students x dates DataFrame, as shown in Excel."""
+        with closing(self.connect()) as connection:
+            records = pd.read_sql_query("SELECT name, day, status FROM attendance WHERE class_id = ?",
+                                        connection, params=(class_id,))
+
+        students = self.students(class_id)
+        if records.empty:
+            return pd.DataFrame(index=students)
+
+        df = records.pivot(index='name', columns='day', values='status')
+        df = df.reindex(index=students, columns=sorted(df.columns))
+        df.index.name = None
+        df.columns.name = None
+        return df
+
+    @classmethod
+    def export_lock(cls, excel_file_path):
+        """Returns the lock serializing the exports of this process to the given workbook."""
+        with cls._export_locks_guard:
+            return cls._export_locks.setdefault(os.path.abspath(excel_file_path), threading.Lock())
+
+    def export_excel(self, excel_file_path, class_id):
+        """Writes the class sheet of the Excel workbook, keeping the other sheets of the workbook."""
+        with self.export_lock(excel_file_path):
+            return self._export_excel(excel_file_path, class_id)
+
+    def _export_excel(self, excel_file_path, class_id):
+        df = self.to_dataframe(class_id)
+
+        if os.path.isfile(excel_file_path):
+            writer = pd.ExcelWriter(excel_file_path, engine='openpyxl', mode='a', if_sheet_exists='replace')
+        else:
+            writer = pd.ExcelWriter(excel_file_path, engine='xlsxwriter')
+
+        with writer:
+            df.to_excel(writer, sheet_name=class_id)
+            sheet = writer.sheets[class_id]
+
+            # Dates have a fixed width, only the names column needs measuring
+            widths = [max([len(str(name)) for name in df.index] + [0])]
+            widths += [max(len(str(column)), 1) for column in df.columns]
+            for col_idx, width in enumerate(widths):
+                if hasattr(sheet, 'set_column'):  # xlsxwriter
+                    sheet.set_column(col_idx, col_idx, width + 1)  # add a little extra width
+                else:  # openpyxl
+                    from openpyxl.utils import get_column_letter
+                    sheet.column_dimensions[get_column_letter(col_idx + 1)].width = width + 1
+
+        return df
+
+
+class ExcelExportScheduler:
+    """Exports the class sheets of long-running processes (the watcher, the recognition service) at most
+    once per class every `delay` seconds, so recording a run costs the same on day 1 and day 180."""
+
+    def __init__(self, delay=60.0):
+        self.delay = delay
+        self.pending = {}  # (excel_file_path, class_id) -> timer of the export due
+        self.lock = threading.Lock()
+
+    def schedule(self, excel_file_path, class_id):
+        """Exports the class sheet after the delay, unless an export of it is already due."""
+        key = (excel_file_path, class_id)
+        with self.lock:
+            if key in self.pending:
+                return  # the export due will include this run
+            timer = threading.Timer(self.delay, self.export, key)
+            timer.daemon = True
+            self.pending[key] = timer
+            timer.start()
+
+    def export(self, excel_file_path, class_id):
+        with self.lock:
+            self.pending.pop((excel_file_path, class_id), None)
+        try:
+            AttendanceStore.for_excel_file(excel_file_path).export_excel(excel_file_path, class_id)
+        except PermissionError:
+            print(f"{excel_file_path} is open in another program, class {class_id} will be exported later.")
+            self.schedule(excel_file_path, class_id)
+        except Exception as e:
+            print(f"Export of class {class_id} to {excel_file_path} failed, {e}")
+
+    def flush(self):
+        """Runs the exports due now, before the process exits."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for key, timer in pending.items():
+            timer.cancel()
+            self.export(*key)
+
+
+# Example usage: python attendance_store.py <store.sqlite> <class ID> <export.xlsx>
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 4:
+        sys.exit("usage: python attendance_store.py <store.sqlite> <class ID> <export.xlsx>")
+
+    AttendanceStore(sys.argv[1]).export_excel(sys.argv[3], sys.argv[2])
+    print(f"Attendance of class {sys.argv[2]} exported to {sys.argv[3]}.")
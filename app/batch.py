@@ -0,0 +1,180 @@
+"""Headless batch processing of class photos, without the Tk interface.
+
+Example usage:
+    python batch.py --class 7A "photos/7A/*.jpg" --class 7B photos/7B/morning.jpg --summary summary.json
+"""
+import sys
+import glob
+import json
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from config_manager import ConfigManager
+from attendance_store import AttendanceStore
+from face_backends import FaceBackend
+from face_recognition_manager import FaceRecognitionManager
+
+
+def expand_photos(patterns):
+    """Expands the given paths and glob patterns into a sorted list of photo paths."""
+    photos = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        photos.extend(matches if matches else [pattern])
+    return list(dict.fromkeys(photos))  # drop duplicates, keep order
+
+
+def process_class(config_manager, class_id, photos, tolerance=None, workers=None, detection_max_side=None,
+                  upsample_region=None, profile=None, gallery=None):
+    """Runs the recognition of one class over all of its photos and records the attendance in the store,
+    the Excel sheet is exported afterwards by export_class. A student is present when they are recognized
+    in at least one of the photos.
+    With a school-wide gallery index, faces recognized as students of other classes are reported as visitors."""
+    summary = {'class_id': class_id, 'photos': photos, 'faces': 0}
+    try:
+        settings = config_manager.get_class_settings(class_id)
+    except ValueError as e:
+        summary['error'] = str(e)
+        return summary
+
+    # Command line options override the settings of the class
+    face_manager = FaceRecognitionManager(
+        settings.directory_path, None, settings.excel_file_path,
+        tolerance=tolerance if tolerance is not None else settings.tolerance,
+        workers=workers or settings.workers,
+        detection_max_side=detection_max_side or settings.detection_max_side,
+        upsample_region=upsample_region or settings.upsample_region,
+        profile=profile or settings.profile,
+        detector_model_path=settings.detector_model_path,
+        gallery_storage=settings.gallery_storage,
+    )
+    recorder = face_manager.start_run(source="batch", class_id=class_id, photos=photos)
+    try:
+        results, distances = {}, {}
+        visitors = {}  # (home class, name) -> closest match
+        if gallery is not None and gallery.backend_tag != face_manager.backend.tag:
+            gallery = None  # embeddings of another backend can't be compared
+        for photo in photos:
+            face_manager.anchor_image_path = photo
+            face_encodings = face_manager.encode_faces()
+            photo_results, photo_distances, assigned = face_manager.compare_faces(face_encodings, assigned_faces=True)
+            summary['faces'] += len(face_encodings)
+
+            if gallery is not None:
+                # Only the faces left unrecognized by the class's own roster can be visitors
+                assigned_faces = set(assigned.values())
+                unassigned = [encoding for face, encoding in enumerate(face_encodings) if face not in assigned_faces]
+                # Exact search: a visitor missed by the partitions would go unreported, and the batch scans few faces
+                for match in gallery.identify(unassigned, face_manager.matcher.tolerance, exact=True):
+                    if match is not None and match[0] != class_id:
+                        home_class, name, distance = match
+                        visitor = visitors.get((home_class, name))
+                        if visitor is None or distance < visitor['distance']:
+                            visitors[(home_class, name)] = {'home_class': home_class, 'name': name,
+                                                            'distance': distance}
+
+            for name, result in photo_results.items():
+                if result == '✓' or name not in results:
+                    results[name] = result
+                if photo_distances[name] is not None:
+                    distances[name] = min(distances.get(name, photo_distances[name]), photo_distances[name])
+
+        face_manager.update_attendance(results, class_id)
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+        recorder.finish("error", error=summary['error'])
+        return summary
+    finally:
+        face_manager.close()
+    recorder.finish("ok", present=sum(result == '✓' for result in results.values()))
+
+    summary.update({
+        'excel_file_path': face_manager.file_path,
+        'present': sorted(name for name, result in results.items() if result == '✓'),
+        'absent': sorted(name for name, result in results.items() if result != '✓'),
+        'distances': distances,
+        'unrecognized_files': face_manager.unrecognized_files,
+    })
+    if gallery is not None:
+        # Visitors of different classes may share a name
+        summary['visitors'] = [visitors[key] for key in sorted(visitors)]
+    return summary
+
+
+def export_class(summary):
+    """Exports the class sheet of a processed class to its Excel workbook."""
+    try:
+        store = AttendanceStore.for_excel_file(summary['excel_file_path'])
+        store.export_excel(summary['excel_file_path'], summary['class_id'])
+    except Exception as e:
+        summary['error'] = f"Excel export failed, {type(e).__name__}: {e}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process class photos and update attendance without the GUI.")
+    parser.add_argument('--class', dest='jobs', nargs='+', action='append', required=True,
+                        metavar=('CLASS_ID', 'PHOTO'), help="a class ID followed by its photo paths or glob patterns")
+    parser.add_argument('--config', default='app_config.json', help="path to the configuration file")
+    parser.add_argument('--tolerance', type=float, default=None, help="maximum face distance counted as a match")
+    parser.add_argument('--profile', choices=list(FaceBackend.profiles), default=None,
+                        help="speed/accuracy profile, overrides the profile of the classes")
+    parser.add_argument('--max-side', type=int, default=None, help="longest side of the image used for face detection")
+    parser.add_argument('--upsample-region', type=float, nargs=2, default=None, metavar=('TOP', 'BOTTOM'),
+                        help="band of the photo, as fractions of its height, searched again for small faces")
+    parser.add_argument('--classes-in-parallel', type=int, default=4, help="number of classes processed at once")
+    parser.add_argument('--workers', type=int, default=None, help="processes used to encode the students' pictures")
+    parser.add_argument('--no-excel', dest='export_excel', action='store_false',
+                        help="only update the attendance store, without exporting the Excel sheets")
+    parser.add_argument('--identify-visitors', action='store_true',
+                        help="search the faces in the rosters of all classes and report students from other classes")
+    parser.add_argument('--summary', default=None, help="write the machine-readable summary to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config_manager = ConfigManager(args.config)
+
+    jobs = {}
+    for class_id, *patterns in args.jobs:
+        if not patterns:
+            sys.exit(f"No photo given for class {class_id}")
+        jobs.setdefault(class_id, []).extend(expand_photos(patterns))
+
+    gallery = None
+    if args.identify_visitors:
+        from gallery_index import GalleryIndex
+        gallery = GalleryIndex.from_config(config_manager, args.profile, args.workers)
+
+    # Threads share the models already loaded in this process
+    with ThreadPoolExecutor(max_workers=max(1, args.classes_in_parallel)) as executor:
+        futures = [executor.submit(process_class, config_manager, class_id, photos, args.tolerance, args.workers,
+                                   args.max_side, args.upsample_region, args.profile, gallery)
+                   for class_id, photos in jobs.items()]
+        summaries = [future.result() for future in futures]
+
+    # Classes usually share one workbook, which is rewritten on every export: one export at a time
+    if args.export_excel:
+        for summary in summaries:
+            if 'error' not in summary:
+                export_class(summary)
+
+    for summary in summaries:
+        if 'error' in summary:
+            print(f"{summary['class_id']}: failed, {summary['error']}")
+        else:
+            print(f"{summary['class_id']}: {len(summary['present'])} present, {len(summary['absent'])} absent "
+                  f"({summary['faces']} faces in {len(summary['photos'])} photos)")
+
+    report = {'generated_at': datetime.now().isoformat(timespec='seconds'), 'classes': summaries}
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as summary_file:
+            json.dump(report, summary_file, indent=4, ensure_ascii=False)
+    else:
+        print(json.dumps(report, indent=4, ensure_ascii=False))
+
+    return 1 if any('error' in summary for summary in summaries) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""Benchmark of the recognition pipeline on locally generated fixtures.
+
+Times every stage of FaceRecognitionManager while sweeping the roster size, the number of faces per
+photo, the photo resolution and the length of the attendance history, and writes the results to JSON.
+
+Example usage:
+    python benchmark.py --stub --output bench_results.json
+    python benchmark.py --stub --compare bench_results.json --threshold 1.25
+    python benchmark.py --gallery 1000 10000
+    python benchmark.py --panorama 8660x5773 --tile-workers 1 2 4 8
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import itertools
+import statistics
+from datetime import date, datetime, timedelta
+import cv2
+import numpy as np
+
+
+class StubFaceRecognition:
+    """Stand-in for the face_recognition module that needs no dlib models.
+
+    Synthetic faces are bright squares holding a 16x8 block pattern unique to each student, drawn on a
+    dark background. Detection finds the squares and the 128-d encoding is the normalized pattern, so
+    matching behaves like the real thing: a student's photo and picture encode to nearby points.
+    """
+    pattern_shape = (16, 8)
+
+    @staticmethod
+    def face_locations(image, number_of_times_to_upsample=1, model='hog'):
+        gray = image.max(axis=2) if image.ndim == 3 else image
+        count, _, stats, _ = cv2.connectedComponentsWithStats((gray > 32).astype(np.uint8))
+        return [(int(top), int(left + width), int(top + height), int(left))
+                for left, top, width, height, area in stats[1:count] if width >= 8 and height >= 8]
+
+    @classmethod
+    def face_encodings(cls, face_image, known_face_locations=None, num_jitters=1, model='small'):
+        if known_face_locations is None:
+            known_face_locations = cls.face_locations(face_image)
+
+        encodings = []
+        for top, right, bottom, left in known_face_locations:
+            crop = face_image[top:bottom, left:right].mean(axis=2).astype(np.float32)
+            pattern = cv2.resize(crop, cls.pattern_shape[::-1], interpolation=cv2.INTER_AREA).ravel()
+            pattern -= pattern.mean()
+            encodings.append(pattern / (np.linalg.norm(pattern) or 1.0))
+        return encodings
+
+
+def student_pattern(index):
+    """The 16x8 block pattern, values in [64, 255], that identifies a synthetic student."""
+    rng = np.random.default_rng(index)
+    return rng.integers(64, 256, size=StubFaceRecognition.pattern_shape, dtype=np.uint8)
+
+
+def draw_face(image, index, top, left, side):
+    pattern = cv2.resize(student_pattern(index), (side, side), interpolation=cv2.INTER_NEAREST)
+    image[top:top + side, left:left + side] = pattern[:, :, None]
+
+
+def make_fixtures(root, roster_size, faces, resolution):
+    """Writes the students' pictures and a class photo holding `faces` faces, the first of them students."""
+    directory_path = os.path.join(root, f"roster_{roster_size}")
+    if not os.path.isdir(directory_path):
+        os.makedirs(directory_path)
+        for index in range(roster_size):
+            picture = np.zeros((200, 200, 3), dtype=np.uint8)
+            draw_face(picture, index, 20, 20, 160)
+            cv2.imwrite(os.path.join(directory_path, f"student_{index:04d}.png"), picture)
+
+    width, height = resolution
+    anchor_image_path = os.path.join(root, f"photo_{faces}_{width}x{height}.png")
+    if not os.path.isfile(anchor_image_path):
+        photo = np.zeros((height, width, 3), dtype=np.uint8)
+        columns = int(np.ceil(np.sqrt(faces * width / height)))
+        rows = int(np.ceil(faces / columns))
+        cell = min(width // columns, height // rows)
+        side = int(cell * 0.6)
+        for face in range(faces):
+            # Faces beyond the roster are visitors the matcher must leave unmatched
+            index = face if face < roster_size else 100000 + face
+            row, column = divmod(face, columns)
+            draw_face(photo, index, row * cell + (cell - side) // 2, column * cell + (cell - side) // 2, side)
+        cv2.imwrite(anchor_image_path, photo)
+
+    return directory_path, anchor_image_path
+
+
+def seed_history(face_manager, class_id, days):
+    """Fills the attendance store with `days` past days of attendance."""
+    from attendance_store import AttendanceStore
+
+    names = sorted(name.capitalize() for name in face_manager.known_faces)
+    store = AttendanceStore.for_excel_file(face_manager.file_path)
+    store.add_students(class_id, names)
+    for offset in range(days, 0, -1):
+        day = (date.today() - timedelta(days=offset)).strftime(r"%Y-%m-%d")
+        store.record(class_id, day, {name: '✓' for name in names[::2]})
+
+
+def timed(samples, stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    samples.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def run_case(root, roster_size, faces, resolution, history, repeats, stub):
+    from image_loading import load_image
+    from attendance_store import AttendanceStore
+    from face_recognition_manager import FaceRecognitionManager
+
+    directory_path, anchor_image_path = make_fixtures(root, roster_size, faces, resolution)
+    samples = {}
+    face_count = 0
+
+    for repeat in range(repeats):
+        case_dir = tempfile.mkdtemp(dir=root)
+        excel_file_path = os.path.join(case_dir, "class attendance.xlsx")
+        # Worker processes would not see the stub, keep the stub runs in process
+        face_manager = FaceRecognitionManager(directory_path, anchor_image_path, excel_file_path,
+                                              workers=1 if stub else None)
+        face_manager.cache.cache_path = os.path.join(case_dir, "embeddings.npz")
+        face_manager.result_cache = None  # time the detection and encoding on every repeat
+
+        timed(samples, "decode", load_image, anchor_image_path, FaceRecognitionManager.anchor_max_side)
+        timed(samples, "crop_faces", face_manager.crop_faces)
+        face_encodings = timed(samples, "encode_faces", face_manager.encode_faces)
+        face_count = len(face_encodings)
+        timed(samples, "load_known_faces_cold", face_manager.load_known_faces, rebuild=True)
+        timed(samples, "load_known_faces_warm", face_manager.load_known_faces)
+        results, _ = timed(samples, "compare_faces", face_manager.compare_faces, face_encodings)
+
+        seed_history(face_manager, "bench", history)
+        timed(samples, "update_attendance", face_manager.update_attendance, results, "bench")
+        store = AttendanceStore.for_excel_file(excel_file_path)
+        timed(samples, "export_excel", store.export_excel, excel_file_path, "bench")
+        shutil.rmtree(case_dir, ignore_errors=True)
+
+    return {
+        'roster_size': roster_size,
+        'faces': faces,
+        'resolution': f"{resolution[0]}x{resolution[1]}",
+        'history': history,
+        'faces_detected': face_count,
+        'present': sum(result == '✓' for result in results.values()),
+        'stages': {stage: statistics.median(times) for stage, times in samples.items()},
+    }
+
+
+def gallery_report(students, photos=20, faces=30, tolerance=0.6, seed=0):
+    """Memory and accuracy of each QuantizedGallery storage against the float64 prototypes,
+    on synthetic embeddings spread like dlib's (other people ~0.7 apart, the same person ~0.25-0.65).
+    Matching is timed on the gallery built in memory and on its memory-mapped copy."""
+    from face_matcher import FaceMatcher
+    from quantized_gallery import QuantizedGallery
+
+    rng = np.random.default_rng(seed)
+    common = rng.normal(0, 0.06, FaceMatcher.encoding_size)
+    known_faces = {f"student_{index:05d}": common + rng.normal(0, 0.045, (rng.integers(1, 4), FaceMatcher.encoding_size))
+                   for index in range(students)}
+    names = list(known_faces)
+    queries = []
+    for _ in range(photos):
+        present = rng.choice(len(names), int(faces * 0.8), replace=False)
+        photo = [known_faces[names[index]][0] + rng.normal(0, rng.uniform(0.015, 0.045), FaceMatcher.encoding_size)
+                 for index in present]
+        photo += [common + rng.normal(0, 0.045, FaceMatcher.encoding_size) for _ in range(faces - len(photo))]
+        queries.append(photo)
+
+    matcher = FaceMatcher(tolerance)
+    with tempfile.TemporaryDirectory() as directory:
+        reference, report = None, []
+        for storage in QuantizedGallery.storages:
+            gallery = QuantizedGallery(known_faces, storage)
+            start = time.perf_counter()
+            matches = [matcher.match_gallery(photo, gallery) for photo in queries]
+            seconds = (time.perf_counter() - start) / photos
+            reference = reference or matches
+
+            # Published class galleries are attached memory-mapped instead
+            gallery.save(os.path.join(directory, storage))
+            mapped = QuantizedGallery.load(os.path.join(directory, storage))
+            start = time.perf_counter()
+            for photo in queries:
+                matcher.match_gallery(photo, mapped)
+            mapped_seconds = (time.perf_counter() - start) / photos
+
+            decisions = sum(len(results) for results, _ in reference)
+            changed = sum(results[name] != expected[name] for (results, _), (expected, _) in zip(matches, reference)
+                          for name in results)
+            error = max(abs(distances[name] - expected[name]) for (_, distances), (_, expected) in zip(matches, reference)
+                        for name in distances)
+            report.append({'storage': storage, 'bytes': gallery.nbytes,
+                           'ratio': round(gallery.nbytes / report[0]['bytes'], 3) if report else 1.0,
+                           'scanned_bytes': gallery.scanned_nbytes,
+                           'scanned_ratio': round(gallery.scanned_nbytes / report[0]['scanned_bytes'], 3) if report else 1.0,
+                           'changed_decisions': changed, 'decisions': decisions, 'max_distance_error': error,
+                           'rechecked': gallery.rechecked, 'match_ms': round(seconds * 1000, 3),
+                           'mapped_match_ms': round(mapped_seconds * 1000, 3)})
+    return {'students': students, 'prototypes': sum(len(student) for student in known_faces.values()),
+            'photos': photos, 'faces': faces, 'tolerance': tolerance, 'storages': report}
+
+
+def panorama_report(resolution, worker_counts, tile_side=1600, faces=200):
+    """Wall time of the tiled detection of a synthetic panorama for each number of worker processes."""
+    from face_detection import locate_faces_tiled, tile_grid
+
+    width, height = resolution
+    panorama = np.zeros((height, width, 3), dtype=np.uint8)
+    rng = np.random.default_rng(0)
+    for index in range(faces):
+        draw_face(panorama, index, int(rng.integers(0, height - 48)), int(rng.integers(0, width - 48)), 48)
+
+    report = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        boxes = locate_faces_tiled(panorama, tile_side, tile_side // 8, workers=workers)
+        report.append({'workers': workers, 'seconds': round(time.perf_counter() - start, 3), 'faces': len(boxes)})
+    return {'resolution': f"{width}x{height}", 'tile_side': tile_side,
+            'tiles': len(tile_grid(panorama.shape, tile_side, tile_side // 8)), 'runs': report}
+
+
+def case_key(case):
+    return case['roster_size'], case['faces'], case['resolution'], case['history']
+
+
+def find_regressions(results, baseline, threshold):
+    """Returns the stages that got slower than threshold times the baseline run."""
+    previous = {case_key(case): case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        before = previous.get(case_key(case))
+        if before is None: continue
+        for stage, seconds in case['stages'].items():
+            reference = before['stages'].get(stage)
+            if reference and seconds > reference * threshold:
+                regressions.append({'case': case_key(case), 'stage': stage, 'baseline': reference,
+                                    'current': seconds, 'ratio': seconds / reference})
+    return regressions
+
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recognition pipeline on synthetic fixtures.")
+    parser.add_argument('--roster', type=int, nargs='+', default=[10, 35, 100], help="roster sizes")
+    parser.add_argument('--faces', type=int, nargs='+', default=[10, 30], help="faces per class photo")
+    parser.add_argument('--resolution', type=parse_resolution, nargs='+', default=[(1280, 960), (4032, 3024)],
+                        help="class photo resolutions, as WIDTHxHEIGHT")
+    parser.add_argument('--history', type=int, nargs='+', default=[1, 180], help="days of attendance history")
+    parser.add_argument('--repeats', type=int, default=3, help="runs per case, the median is reported")
+    parser.add_argument('--stub', action='store_true', help="use the stub encoder instead of the dlib models")
+    parser.add_argument('--output', default='bench_results.json', help="JSON file the results are written to")
+    parser.add_argument('--compare', default=None, help="previous results to check for regressions")
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument('--gallery', type=int, nargs='+', default=None,
+                        help="gallery sizes to report the memory and accuracy of each storage for, "
+                             "instead of timing the pipeline")
+    parser.add_argument('--panorama', type=parse_resolution, default=None,
+                        help="time the tiled detection of a WIDTHxHEIGHT panorama instead of the pipeline")
+    parser.add_argument('--tile-workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="worker process counts the panorama is detected with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.stub:
+        # Installed before the pipeline modules are imported, so the dlib models are never loaded
+        sys.modules['face_recognition'] = StubFaceRecognition
+
+    if args.panorama:
+        panorama = panorama_report(args.panorama, args.tile_workers)
+        for run in panorama['runs']:
+            print(f"{panorama['resolution']} in {panorama['tiles']} tiles, {run['workers']} workers: "
+                  f"{run['seconds']:.2f}s, {run['faces']} faces")
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({'generated_at': datetime.now().isoformat(timespec='seconds'), 'stub': args.stub,
+                       'panorama': panorama}, output_file, indent=4)
+        print(f"Results written to {args.output}")
+        return 0
+
+    if args.gallery:
+        galleries = [gallery_report(students) for students in args.gallery]
+        for gallery in galleries:
+            for storage in gallery['storages']:
+                print(f"students={gallery['students']} {storage['storage']}: {storage['bytes'] / 1024:.0f} KB "
+                      f"in memory ({storage['ratio']:.0%}), {storage['scanned_bytes'] / 1024:.0f} KB scanned "
+                      f"({storage['scanned_ratio']:.0%}), {storage['changed_decisions']}/{storage['decisions']} "
+                      f"decisions changed, max distance error {storage['max_distance_error']:.2e}, "
+                      f"{storage['rechecked']} rechecked, {storage['match_ms']:.2f}ms per photo "
+                      f"({storage['mapped_match_ms']:.2f}ms memory-mapped)")
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({'generated_at': datetime.now().isoformat(timespec='seconds'), 'galleries': galleries},
+                      output_file, indent=4)
+        print(f"Results written to {args.output}")
+        return 0
+
+    root = tempfile.mkdtemp(prefix="face_benchmark_")
+    results = []
+    try:
+        for roster_size, faces, resolution, history in itertools.product(args.roster, args.faces,
+                                                                         args.resolution, args.history):
+            case = run_case(root, roster_size, faces, resolution, history, args.repeats, args.stub)
+            results.append(case)
+            stages = ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in case['stages'].items())
+            print(f"roster={roster_size} faces={faces} resolution={case['resolution']} history={history}: {stages}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'stub': args.stub,
+        'results': results,
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.threshold)
+        report['regressions'] = regressions
+        for regression in regressions:
+            print(f"REGRESSION {regression['case']} {regression['stage']}: "
+                  f"{regression['baseline'] * 1000:.1f}ms -> {regression['current'] * 1000:.1f}ms")
+
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=4)
+    print(f"Results written to {args.output}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
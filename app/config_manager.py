@@ -1,23 +1,93 @@
+import os
 import json
+import copy
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX advisory locks
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
+
+
+# Named schema of a class configuration, settings after excel_file_path are optional
+ClassConfig = namedtuple(
+    'ClassConfig',
+    ['directory_path', 'excel_file_path', 'tolerance', 'workers', 'detection_max_side', 'upsample_region',
+     'profile', 'detector_model_path', 'drop_folder', 'gallery_storage'],
+    defaults=(None, None, None, None, None, None, None, None),
+)
+
 
 class ConfigManager:
     def __init__(self, config_path='app_config.json'):
         # Constructor that sets the path to the configuration file, defaulting to 'app_config.json'
         self.config_path = config_path
+        self.lock_path = config_path + '.lock'
+        self._config = None  # parsed configuration, valid while the file keeps the same signature
+        self._signature = None
 
-    def load_config(self):
-        """Load the entire configuration file as a dictionary."""
+    def _file_signature(self):
+        """Returns (mtime, size) of the configuration file, or None if it does not exist."""
         try:
-            with open(self.config_path, 'r') as config_file:
-                return json.load(config_file)  # Load and return the configuration as a dictionary
+            stat = os.stat(self.config_path)
         except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def locked(self):
+        """Advisory lock held while reading and writing back the configuration,
+        so that concurrent writers (the GUI and a scheduled job) don't overwrite each other."""
+        with open(self.lock_path, 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def load_config(self):
+        """Load the entire configuration file as a dictionary, parsing it again only when the file changed."""
+        signature = self._file_signature()
+        if signature is None:
             print("Configuration file not found, initializing with default settings.")
+            self._config, self._signature = None, None
             return {}  # Return an empty dictionary if the file does not exist
 
+        if self._config is None or signature != self._signature:
+            with open(self.config_path, 'r') as config_file:
+                self._config = json.load(config_file)  # Load the configuration as a dictionary
+            self._signature = signature
+
+        return copy.deepcopy(self._config)  # callers may modify the returned dictionary
+
     def save_config(self, config):
-        """Save the provided configuration dictionary to the JSON file."""
-        with open(self.config_path, 'w') as config_file:
+        """Save the provided configuration dictionary to the JSON file, atomically."""
+        directory = os.path.dirname(os.path.abspath(self.config_path))
+        # Write a temporary file next to the configuration and swap it in, a crash never leaves a truncated file
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as config_file:
             json.dump(config, config_file, indent=4)  # Save the dictionary to a file with indentation
+            config_file.flush()
+            os.fsync(config_file.fileno())
+        # Keep the permissions of the file being replaced, temporary files are created private
+        try:
+            mode = os.stat(self.config_path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(config_file.name, mode)
+        os.replace(config_file.name, self.config_path)
+
+        self._config, self._signature = copy.deepcopy(config), self._file_signature()
         print("Configuration saved.")  # Confirm that the configuration has been saved
 
     def get_class_config(self, class_id):
@@ -25,26 +95,42 @@ class ConfigManager:
         config = self.load_config()  # Load the full configuration
         return config.get(class_id, {})  # Return the configuration for the specified class ID or an empty dict
 
-    def set_class_config(self, class_id, directory_path=None, excel_file_path=None):
-        """Set the directory and Excel file paths for a given class ID."""
-        config = self.load_config()  # Load the current configuration
-        class_config = config.get(class_id, {})  # Get the current class configuration or initialize a new one
+    def get_class_settings(self, class_id):
+        """Retrieve the configuration of a class as a ClassConfig with named fields.
+        Raises ValueError when the class is missing or its configuration is incomplete."""
+        class_config = self.get_class_config(class_id)
+        try:
+            return ClassConfig(**class_config)
+        except TypeError as e:  # missing required fields or unknown ones
+            raise ValueError(f"Invalid configuration for class ID {class_id}: {e}") from e
+
+    def set_class_config(self, class_id, directory_path=None, excel_file_path=None, **settings):
+        """Set the directory and Excel file paths, and optionally other ClassConfig settings, for a given class ID."""
+        unknown = set(settings) - set(ClassConfig._fields)
+        if unknown:
+            raise ValueError(f"Unknown class settings: {', '.join(sorted(unknown))}")
 
-        # Update the configuration with new directory and Excel file paths if provided
-        if directory_path is not None:
-            class_config['directory_path'] = directory_path
-        if excel_file_path is not None:
-            class_config['excel_file_path'] = excel_file_path
+        with self.locked():
+            config = self.load_config()  # Load the current configuration
+            class_config = config.get(class_id, {})  # Get the current class configuration or initialize a new one
 
-        config[class_id] = class_config  # Update the main configuration dictionary
-        self.save_config(config)  # Save the updated configuration back to the file
+            # Update the configuration with new directory and Excel file paths if provided
+            if directory_path is not None:
+                class_config['directory_path'] = directory_path
+            if excel_file_path is not None:
+                class_config['excel_file_path'] = excel_file_path
+            class_config.update(settings)
+
+            config[class_id] = class_config  # Update the main configuration dictionary
+            self.save_config(config)  # Save the updated configuration back to the file
 
     def delete_class_config(self, class_id):
         """Delete the configuration for a specific class ID."""
-        config = self.load_config()  # Load the current configuration
-        if class_id in config:
-            del config[class_id]  # Remove the entry corresponding to the class ID
-            self.save_config(config)  # Save the updated configuration back to the file
-            print(f"Configuration for class ID {class_id} deleted.")
-        else:
-            print("Class ID not found in configuration.")
+        with self.locked():
+            config = self.load_config()  # Load the current configuration
+            if class_id in config:
+                del config[class_id]  # Remove the entry corresponding to the class ID
+                self.save_config(config)  # Save the updated configuration back to the file
+                print(f"Configuration for class ID {class_id} deleted.")
+            else:
+                print("Class ID not found in configuration.")
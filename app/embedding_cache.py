@@ -0,0 +1,158 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+class EmbeddingCache:
+    """Persistent store of the roster embeddings of one class, kept next to the students' pictures.
+    Each backend has its own cache file, so embeddings of different encoders are never mixed."""
+    # Name of the cache file created inside the students' pictures folder
+    cache_file_name = ".face_embeddings.{backend_tag}.npz"
+    encoding_size = 128
+
+    def __init__(self, directory_path, cache_file_name=None, backend_tag='default'):
+        self.directory_path = directory_path
+        self.backend_tag = backend_tag
+        cache_file_name = (cache_file_name or self.cache_file_name).format(backend_tag=backend_tag)
+        self.cache_path = os.path.join(directory_path, cache_file_name)
+        self.entries = {}  # filename -> {'size', 'mtime', 'sha1', 'encoding'}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+    @staticmethod
+    def file_hash(path, chunk_size=1 << 16):
+        """Returns the SHA-1 digest of the file content."""
+        digest = hashlib.sha1()
+        with open(path, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load(self):
+        """Load the cache file into memory, starting empty if it is missing or unreadable."""
+        self.entries = {}
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                if str(data['backend']) != self.backend_tag:
+                    raise ValueError("cache built by another backend")
+                rows = zip(data['filenames'], data['sizes'], data['mtimes'], data['hashes'], data['encodings'])
+                for filename, size, mtime, sha1, encoding in rows:
+                    self.entries[str(filename)] = {
+                        'size': int(size),
+                        'mtime': int(mtime),
+                        'sha1': str(sha1),
+                        # a NaN row marks a picture in which no face was found
+                        'encoding': None if np.isnan(encoding).any() else encoding,
+                    }
+        except (OSError, KeyError, ValueError):
+            self.entries = {}
+        self._dirty = False
+        return self
+
+    def lookup(self, filename):
+        """Returns the cached entry of an unchanged picture, or None when it has to be encoded again."""
+        path = os.path.join(self.directory_path, filename)
+        stat = os.stat(path)
+        entry = self.entries.get(filename)
+
+        if entry is not None and entry['size'] == stat.st_size:
+            if entry['mtime'] == stat.st_mtime_ns:
+                self.hits += 1
+                return entry
+
+            # The file was touched but may hold the same picture, compare the content itself
+            if entry['sha1'] == self.file_hash(path):
+                entry['mtime'] = stat.st_mtime_ns
+                self._dirty = True
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def update(self, filename, encoding):
+        """Store the encoding (or None when no face was found) of a freshly encoded picture."""
+        path = os.path.join(self.directory_path, filename)
+        stat = os.stat(path)
+        self.entries[filename] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha1': self.file_hash(path),
+            'encoding': encoding,
+        }
+        self._dirty = True
+
+    def prune(self, filenames):
+        """Drop the entries of pictures that no longer exist in the directory."""
+        for filename in set(self.entries) - set(filenames):
+            del self.entries[filename]
+            self._dirty = True
+
+    def save(self):
+        """Write the cache to disk atomically, only if something changed since it was loaded."""
+        if not self._dirty:
+            return
+
+        filenames = sorted(self.entries)
+        # float32 halves the file, the encodings don't carry more precision than that
+        encodings = np.full((len(filenames), self.encoding_size), np.nan, dtype=np.float32)
+        for row, filename in enumerate(filenames):
+            if self.entries[filename]['encoding'] is not None:
+                encodings[row] = self.entries[filename]['encoding']
+
+        # A temporary file of its own, several processes or threads may save the cache of the same roster
+        with tempfile.NamedTemporaryFile(dir=self.directory_path, suffix='.tmp', delete=False) as cache_file:
+            np.savez_compressed(
+                cache_file,
+                filenames=np.array(filenames, dtype=str),
+                sizes=np.array([self.entries[f]['size'] for f in filenames], dtype=np.int64),
+                mtimes=np.array([self.entries[f]['mtime'] for f in filenames], dtype=np.int64),
+                hashes=np.array([self.entries[f]['sha1'] for f in filenames], dtype=str),
+                encodings=encodings,
+                backend=np.array(self.backend_tag),
+            )
+        os.chmod(cache_file.name, 0o644)  # temporary files are created private
+        os.replace(cache_file.name, self.cache_path)
+        self._dirty = False
+
+    def clear(self):
+        """Forget every cached embedding and delete the cache file, forcing a full rebuild."""
+        self.entries = {}
+        self._dirty = False
+        try:
+            os.remove(self.cache_path)
+        except FileNotFoundError:
+            pass
+
+    def info(self):
+        """Returns a summary of the cache content, used for inspection."""
+        return {
+            'cache_path': self.cache_path,
+            'backend': self.backend_tag,
+            'exists': os.path.isfile(self.cache_path),
+            'size_bytes': os.path.getsize(self.cache_path) if os.path.isfile(self.cache_path) else 0,
+            'entries': len(self.entries),
+            'without_face': sorted(f for f, entry in self.entries.items() if entry['encoding'] is None),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+# Example usage: python embedding_cache.py <students pictures folder> [--clear]
+if __name__ == "__main__":
+    import sys, glob, json
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python embedding_cache.py <students pictures folder> [--clear]")
+
+    # One cache per backend that was used on the folder
+    prefix, suffix = EmbeddingCache.cache_file_name.split("{backend_tag}")
+    for cache_path in sorted(glob.glob(os.path.join(glob.escape(sys.argv[1]), prefix + "*" + suffix))):
+        backend_tag = os.path.basename(cache_path)[len(prefix):-len(suffix)]
+        cache = EmbeddingCache(sys.argv[1], backend_tag=backend_tag).load()
+        if "--clear" in sys.argv[2:]:
+            cache.clear()
+            print(f"Embedding cache of {backend_tag} cleared, it will be rebuilt on the next run.")
+        print(json.dumps(cache.info(), indent=4))
@@ -0,0 +1,183 @@
+import os
+import cv2
+import face_recognition
+from concurrent.futures import ProcessPoolExecutor
+from face_detection import downscale, scale_boxes, locate_faces, locate_faces_tiled, tile_grid
+
+
+class Detector:
+    """Finds faces in an RGB image and returns (top, right, bottom, left) boxes in full resolution."""
+    name = None
+    full_resolution = False  # whether the class photo should be decoded without downscaling
+
+    def locate(self, image):
+        raise NotImplementedError
+
+    def roster_detector(self):
+        """The detector of the students' pictures, which hold a single face."""
+        return self
+
+    def close(self):
+        """Releases the resources kept across calls."""
+
+
+class DlibDetector(Detector):
+    """face_recognition's HOG or CNN detector, run coarse-to-fine on a downscaled copy."""
+
+    def __init__(self, model='hog', max_side=None, upsample_region=None):
+        self.model = model
+        self.name = model
+        self.max_side = max_side
+        self.upsample_region = upsample_region
+
+    def locate(self, image):
+        return locate_faces(image, self.max_side, self.upsample_region, model=self.model)
+
+
+class TiledDetector(Detector):
+    """face_recognition's HOG or CNN detector run at full resolution on overlapping tiles in parallel,
+    for panoramas whose faces are too small to be found on a downscaled copy."""
+    full_resolution = True
+
+    def __init__(self, model='hog', tile_side=1600, overlap=None, workers=None):
+        self.model = model
+        self.name = f"{model}-tiled"
+        self.tile_side = tile_side
+        self.overlap = overlap or tile_side // 8  # must exceed the faces that cross a seam
+        self.workers = workers
+        # Worker processes kept across calls (a video is detected frame by frame), started on first use
+        self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def locate(self, image):
+        workers = self.workers or os.cpu_count() or 1
+        if self._executor is None and workers > 1 and len(tile_grid(image.shape, self.tile_side, self.overlap)) > 1:
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        return locate_faces_tiled(image, self.tile_side, self.overlap, self.model, workers, self._executor)
+
+    def roster_detector(self):
+        # Portraits fit in a tile, the enrollment workers must not start tile pools of their own
+        return DlibDetector(self.model, self.tile_side)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+class YuNetDetector(Detector):
+    """OpenCV's YuNet DNN detector, much faster than HOG on CPU. Needs the ONNX model file
+    (face_detection_yunet_2023mar.onnx from the OpenCV model zoo)."""
+    name = 'yunet'
+
+    def __init__(self, model_path, max_side=None, score_threshold=0.8):
+        self.model_path = model_path
+        self.max_side = max_side
+        self.score_threshold = score_threshold
+        self._detector = None  # created on first use, OpenCV objects can't be sent to worker processes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_detector'] = None
+        return state
+
+    def locate(self, image):
+        small, scale = downscale(image, self.max_side)
+        height, width = small.shape[:2]
+        if self._detector is None:
+            self._detector = cv2.FaceDetectorYN.create(self.model_path, "", (width, height), self.score_threshold)
+        self._detector.setInputSize((width, height))
+
+        _, faces = self._detector.detect(cv2.cvtColor(small, cv2.COLOR_RGB2BGR))
+        if faces is None:
+            return []
+
+        boxes = [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces[:, :4]]
+        return scale_boxes(boxes, scale, shape=image.shape)
+
+
+class Encoder:
+    """Turns the faces at the given boxes of an RGB image into embeddings."""
+    name = None
+
+    def encode(self, image, boxes):
+        raise NotImplementedError
+
+
+class DlibEncoder(Encoder):
+    """face_recognition's dlib ResNet encoder, with the 5-point ('small') or 68-point ('large') alignment."""
+
+    def __init__(self, model='small', num_jitters=1):
+        self.model = model
+        self.num_jitters = num_jitters
+        self.name = f"dlib-{model}-j{num_jitters}"
+
+    def encode(self, image, boxes):
+        return face_recognition.face_encodings(image, known_face_locations=boxes,
+                                               num_jitters=self.num_jitters, model=self.model)
+
+
+class FaceBackend:
+    """A detector and an encoder used together for the class photos and the students' pictures."""
+    # Speed/accuracy profiles that can be selected per class
+    profiles = {
+        'fast': {'detector': 'yunet', 'max_side': 1024, 'encoder_model': 'small', 'num_jitters': 1},
+        'balanced': {'detector': 'hog', 'max_side': 1600, 'encoder_model': 'small', 'num_jitters': 1},
+        'accurate': {'detector': 'cnn', 'max_side': 2400, 'encoder_model': 'large', 'num_jitters': 2},
+        # Full resolution detection on max_side tiles, for panoramas of assemblies and lecture halls
+        'panorama': {'detector': 'tiled', 'max_side': 1600, 'encoder_model': 'small', 'num_jitters': 1},
+    }
+    default_profile = 'balanced'
+
+    def __init__(self, detector, encoder, fallback=None):
+        self.detector = detector
+        self.encoder = encoder
+        self.fallback = fallback  # why the profile's detector was replaced, recorded in the run log
+
+    @property
+    def tag(self):
+        """Identifies the embeddings this backend produces. Embeddings of different tags are never compared."""
+        return self.encoder.name
+
+    @property
+    def settings(self):
+        """Everything the detected boxes and the embeddings of an image depend on."""
+        detector = {name: value for name, value in vars(self.detector).items() if not name.startswith('_')}
+        return {'detector': type(self.detector).__name__, **detector, 'encoder': self.encoder.name}
+
+    @classmethod
+    def from_profile(cls, profile=None, detection_max_side=None, upsample_region=None, detector_model_path=None):
+        """Builds the backend of a profile, the given settings overriding the profile's."""
+        settings = cls.profiles.get(profile or cls.default_profile)
+        if settings is None:
+            raise ValueError(f"Unknown profile {profile}, expected one of {', '.join(cls.profiles)}")
+
+        max_side = detection_max_side or settings['max_side']
+        fallback = None
+        if settings['detector'] == 'yunet' and detector_model_path:
+            detector = YuNetDetector(detector_model_path, max_side)
+        elif settings['detector'] == 'tiled':
+            detector = TiledDetector('hog', max_side)
+        else:
+            if settings['detector'] == 'yunet':
+                fallback = "No YuNet model configured (detector_model_path), using the HOG detector instead"
+            model = 'cnn' if settings['detector'] == 'cnn' else 'hog'
+            detector = DlibDetector(model, max_side, upsample_region)
+
+        return cls(detector, DlibEncoder(settings['encoder_model'], settings['num_jitters']), fallback)
+
+    def roster_backend(self):
+        """The backend of the students' pictures, with the same encoder."""
+        detector = self.detector.roster_detector()
+        return self if detector is self.detector else FaceBackend(detector, self.encoder, self.fallback)
+
+    def close(self):
+        self.detector.close()
+
+    def encode_all(self, image):
+        """Detects and encodes every face of the image."""
+        return self.encoder.encode(image, self.detector.locate(image))
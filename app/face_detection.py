@@ -0,0 +1,147 @@
+import os
+import cv2
+import face_recognition
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def downscale(image, max_side):
+    """Returns a copy of the image whose longest side is at most max_side pixels, and the scale applied."""
+    height, width = image.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return image, 1.0
+
+    scale = max_side / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def scale_boxes(boxes, scale, offset=(0, 0), shape=None):
+    """Maps (top, right, bottom, left) boxes found on a scaled region back to full resolution coordinates."""
+    offset_y, offset_x = offset
+    mapped = []
+    for top, right, bottom, left in boxes:
+        top, right = int(top / scale) + offset_y, int(right / scale) + offset_x
+        bottom, left = int(bottom / scale) + offset_y, int(left / scale) + offset_x
+        if shape is not None:
+            top, left = max(top, 0), max(left, 0)
+            bottom, right = min(bottom, shape[0]), min(right, shape[1])
+        mapped.append((top, right, bottom, left))
+    return mapped
+
+
+def box_overlap(first, second):
+    """Returns the intersection over union of two (top, right, bottom, left) boxes."""
+    top, right = max(first[0], second[0]), min(first[1], second[1])
+    bottom, left = min(first[2], second[2]), max(first[3], second[3])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area = lambda box: (box[2] - box[0]) * (box[1] - box[3])
+    union = area(first) + area(second) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def merge_boxes(boxes, threshold=0.3):
+    """Non-maximum suppression: keeps the largest box of every group of boxes that overlap above threshold."""
+    kept = []
+    for box in sorted(boxes, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]), reverse=True):
+        if all(box_overlap(box, other) <= threshold for other in kept):
+            kept.append(box)
+    # Reading order, top to bottom then left to right
+    return sorted(kept, key=lambda box: (box[0], box[3]))
+
+
+def locate_faces(image, max_side=None, upsample_region=None, model='hog'):
+    """Coarse-to-fine face detection on a possibly very large RGB image.
+
+    Faces are detected on a copy downscaled to max_side pixels and the boxes are mapped back to full
+    resolution. upsample_region=(top, bottom), fractions of the image height, names a horizontal band
+    (typically the back rows, at the top of the photo) detected again at a finer scale to find small faces.
+    """
+    small, scale = downscale(image, max_side)
+    boxes = scale_boxes(face_recognition.face_locations(small, model=model), scale, shape=image.shape)
+
+    if upsample_region is not None:
+        height = image.shape[0]
+        band_top, band_bottom = int(upsample_region[0] * height), int(upsample_region[1] * height)
+        band = image[band_top:band_bottom]
+        if band.size:
+            # The band is detected at the same pixel budget as the whole image, then upsampled once more
+            band_small, band_scale = downscale(band, max_side)
+            band_boxes = face_recognition.face_locations(band_small, number_of_times_to_upsample=2, model=model)
+            boxes = merge_boxes(boxes + scale_boxes(band_boxes, band_scale, (band_top, 0), image.shape))
+
+    return boxes
+
+
+def tile_grid(shape, tile_side, overlap):
+    """Returns the (top, left, bottom, right) tiles, at most tile_side pixels on each side and overlapping
+    their neighbors by overlap pixels, that cover an image of the given shape."""
+    height, width = shape[:2]
+    step = max(1, tile_side - overlap)
+    tops = range(0, max(height - overlap, 1), step)
+    lefts = range(0, max(width - overlap, 1), step)
+    return [(top, left, min(top + tile_side, height), min(left + tile_side, width)) for top in tops for left in lefts]
+
+
+def detect_tile(tile_image, tile, shape, model='hog', edge_margin=2):
+    """Detects the faces of one tile at full resolution and returns their boxes in image coordinates.
+    Faces cut by a tile edge inside the image are dropped, the overlapping tile next to it sees them whole."""
+    top, left, bottom, right = tile
+    height, width = shape[:2]
+    boxes = []
+    for box in face_recognition.face_locations(tile_image, model=model):
+        cut = ((top > 0 and box[0] <= edge_margin) or (left > 0 and box[3] <= edge_margin) or
+               (bottom < height and box[2] >= bottom - top - edge_margin) or
+               (right < width and box[1] >= right - left - edge_margin))
+        if not cut:
+            boxes.append(box)
+    return scale_boxes(boxes, 1.0, (top, left), shape)
+
+
+def detect_coarse(small, scale, shape, model='hog'):
+    """Detects the faces of a downscaled copy of the whole image, finding the faces too large for the tile overlap."""
+    return scale_boxes(face_recognition.face_locations(small, model=model), scale, shape=shape)
+
+
+def locate_faces_tiled(image, tile_side=1600, overlap=200, model='hog', workers=None, executor=None):
+    """Face detection at full resolution for panoramas and large group photos.
+
+    The image is split into overlapping tiles detected in parallel worker processes, plus one coarse pass
+    on a copy downscaled to tile_side for the faces larger than the overlap, and the duplicates at the
+    tile seams are merged with non-maximum suppression. Each detection works on at most tile_side x
+    tile_side pixels, and at most two tiles per worker are in flight, so the memory used by detection
+    does not grow with the image. The worker processes are started for the call, unless a
+    ProcessPoolExecutor of `workers` processes is given to reuse across calls, e.g. on the frames of a video.
+    """
+    tiles = tile_grid(image.shape, tile_side, overlap)
+    if len(tiles) == 1:
+        return face_recognition.face_locations(image, model=model)
+
+    small, scale = downscale(image, tile_side)
+    tasks = [(detect_coarse, small, scale, image.shape, model)]
+    # Views of the image, only copied when sent to a worker
+    tasks += [(detect_tile, image[top:bottom, left:right], (top, left, bottom, right), image.shape, model)
+              for top, left, bottom, right in tiles]
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    boxes = []
+    if workers <= 1:
+        for function, *args in tasks:
+            boxes.extend(function(*args))
+        return merge_boxes(boxes)
+
+    if executor is not None:
+        return merge_boxes(run_tasks(executor, tasks, workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return merge_boxes(run_tasks(executor, tasks, workers))
+
+
+def run_tasks(executor, tasks, workers):
+    """Runs the detection tasks on the executor with at most two per worker in flight, returns all their boxes."""
+    boxes, pending = [], set()
+    for function, *args in tasks:
+        if len(pending) >= 2 * workers:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            boxes.extend(box for future in done for box in future.result())
+        pending.add(executor.submit(function, *args))
+    boxes.extend(box for future in wait(pending).done for box in future.result())
+    return boxes
@@ -0,0 +1,130 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy is optional, fall back to a greedy assignment
+    linear_sum_assignment = None
+
+
+def distance_matrix(face_encodings, known_encodings):
+    """Returns the faces x roster matrix of euclidean distances, computed in one NumPy operation."""
+    faces = np.asarray(face_encodings, dtype=np.float64).reshape(-1, FaceMatcher.encoding_size)
+    known = np.asarray(known_encodings, dtype=np.float64).reshape(-1, FaceMatcher.encoding_size)
+
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, avoids building a faces x roster x 128 array
+    squared = (faces ** 2).sum(axis=1)[:, None] + (known ** 2).sum(axis=1)[None, :] - 2 * faces @ known.T
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def greedy_assignment(distances):
+    """Pairs faces and students by increasing distance, each of them used at most once."""
+    order = np.argsort(distances, axis=None, kind='stable')
+    used_faces, used_students = set(), set()
+    face_indices, student_indices = [], []
+
+    for flat_index in order:
+        face, student = np.unravel_index(flat_index, distances.shape)
+        if face in used_faces or student in used_students: continue
+        used_faces.add(face)
+        used_students.add(student)
+        face_indices.append(face)
+        student_indices.append(student)
+
+    return np.array(face_indices, dtype=int), np.array(student_indices, dtype=int)
+
+
+def build_prototypes(encodings, max_outliers=2, outlier_distance=0.3):
+    """Compresses the encodings of one student's pictures into a few prototypes: their centroid,
+    followed by up to max_outliers pictures far from it (a different angle, glasses, a new haircut)."""
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, FaceMatcher.encoding_size)
+    prototypes = [encodings.mean(axis=0)]
+
+    # Farthest-point selection, each outlier must be far from every prototype already kept
+    for _ in range(max_outliers):
+        distances = distance_matrix(encodings, prototypes).min(axis=1)
+        farthest = int(distances.argmax())
+        if distances[farthest] <= outlier_distance: break
+        prototypes.append(encodings[farthest])
+
+    return np.array(prototypes)
+
+
+class FaceMatcher:
+    """Matches the faces of the anchor image to the roster with an optimal one-to-one assignment."""
+    encoding_size = 128
+    default_tolerance = 0.6  # same default as face_recognition.compare_faces
+
+    def __init__(self, tolerance=None):
+        self.tolerance = self.default_tolerance if tolerance is None else tolerance
+
+    def assign(self, distances):
+        """Returns the (face, student) index pairs of the assignment that minimizes the total distance,
+        keeping only the pairs within tolerance."""
+        if distances.size == 0:
+            return []
+
+        # Pairs beyond tolerance can never match, make them expensive so they don't steer the assignment
+        costs = np.where(distances <= self.tolerance, distances, self.tolerance + 1.0)
+        if linear_sum_assignment is not None:
+            face_indices, student_indices = linear_sum_assignment(costs)
+        else:
+            face_indices, student_indices = greedy_assignment(costs)
+
+        return [(face, student) for face, student in zip(face_indices, student_indices)
+                if distances[face, student] <= self.tolerance]
+
+    @staticmethod
+    def student_distances(face_encodings, known_faces):
+        """Returns the faces x students distance matrix, each student's closest prototype counting."""
+        prototypes = [np.atleast_2d(student) for student in known_faces.values()]
+        starts = np.cumsum([0] + [len(student) for student in prototypes[:-1]])
+        # faces x prototypes, reduced to faces x students by keeping each student's closest prototype
+        return np.minimum.reduceat(distance_matrix(face_encodings, np.vstack(prototypes)), starts, axis=1)
+
+    def resolve(self, matrix, names, assigned_faces=False):
+        """Turns the faces x students distance matrix of one photo into the ✓/✗ results and distances.
+        With assigned_faces, also returns the index of the face assigned to each recognized student."""
+        results = {name: '✗' for name in names}
+        distances = {name: None for name in names}
+        faces = {}
+        if matrix.shape[0] > 0:
+            for student, name in enumerate(names):
+                distances[name] = float(matrix[:, student].min())
+
+            for face, student in self.assign(matrix):
+                results[names[student]] = '✓'
+                distances[names[student]] = float(matrix[face, student])
+                faces[names[student]] = int(face)
+
+        return (results, distances, faces) if assigned_faces else (results, distances)
+
+    def match(self, face_encodings, known_faces):
+        """Returns the ✓/✗ result and the distance of the closest face for every student.
+        Each student may have several prototypes, the closest one counts."""
+        return self.match_many([face_encodings], known_faces)[0]
+
+    def match_many(self, photos_encodings, known_faces, assigned_faces=False):
+        """Matches the faces of several photos of the same class at once: one distance matrix
+        for all their faces, then a separate one-to-one assignment for each photo."""
+        return self.resolve_many(photos_encodings, list(known_faces),
+                                 lambda faces: self.student_distances(faces, known_faces), assigned_faces)
+
+    def match_gallery(self, face_encodings, gallery):
+        """Same as match, against a QuantizedGallery instead of a dict of prototypes."""
+        return self.match_gallery_many([face_encodings], gallery)[0]
+
+    def match_gallery_many(self, photos_encodings, gallery, assigned_faces=False):
+        """Same as match_many, against a QuantizedGallery instead of a dict of prototypes."""
+        return self.resolve_many(photos_encodings, gallery.names,
+                                 lambda faces: gallery.student_distances(faces, self.tolerance), assigned_faces)
+
+    def resolve_many(self, photos_encodings, names, student_distances, assigned_faces=False):
+        """Computes the faces x students matrix of all the photos with student_distances, then resolves each photo."""
+        counts = [len(face_encodings) for face_encodings in photos_encodings]
+        if not names or not sum(counts):
+            return [self.resolve(np.zeros((0, len(names))), names, assigned_faces) for _ in photos_encodings]
+
+        faces = [encoding for face_encodings in photos_encodings for encoding in face_encodings]
+        matrix = student_distances(faces)
+        bounds = np.cumsum([0] + counts)
+        return [self.resolve(matrix[start:end], names, assigned_faces) for start, end in zip(bounds[:-1], bounds[1:])]
@@ -1,82 +1,345 @@
-import os
-import cv2
-import pandas as pd
-import face_recognition
-from datetime import date
-
-class FaceRecognitionManager:
-    def __init__(self, directory_path, anchor_image_path, file_path):
-        self.directory_path = directory_path
-        self.anchor_image_path = anchor_image_path
-        self.file_path = file_path
-        self.known_faces = {}
-
-    def crop_faces(self):
-        """Crops faces from the anchor image."""
-        anchor_image = face_recognition.load_image_file(self.anchor_image_path)
-        face_locations = face_recognition.face_locations(anchor_image)
-        return [anchor_image[top:bottom, left:right] for top, right, bottom, left in face_locations]
-
-    def load_known_faces(self):
-        """loading and embedding the students' pictures into the known_face variable"""
-        for filename in os.listdir(self.directory_path):
-            if not filename.lower().endswith(('.jpg', '.jpeg', '.png')): continue
-
-            image_path = os.path.join(self.directory_path, filename)
-            image = cv2.imread(image_path)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-            try:
-                encoding = face_recognition.face_encodings(rgb_image)[0]
-                name = filename.replace("_", " ")[:filename.rindex(".")].strip()
-                self.known_faces[name] = encoding
-
-            except IndexError:
-                continue
-
-        
-    def compare_faces(self, cropped_faces):
-        """Compares cropped faces to known faces in the directory."""
-        self.load_known_faces()
-
-        results = {name: '✗' for name in self.known_faces}
-        for face in cropped_faces:
-            rgb_face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-            
-            try:
-                face_encoding = face_recognition.face_encodings(rgb_face)[0]
-                matches = face_recognition.compare_faces([encoding for encoding in self.known_faces.values()], face_encoding)
-
-                if any(matches):
-                    match_index = matches.index(True)
-                    matched_name = tuple(self.known_faces)[match_index]
-                    results[matched_name] = '✓'
-
-            except IndexError:
-                continue
-
-        return results
-    
-    def update_dataframe(self, results, df, class_id):
-        """Updates the DataFrame with the recognition results and formats the Excel output."""
-        current_date = date.today().strftime(r"%Y-%m-%d")
-        
-        df.columns = pd.to_datetime(df.columns).strftime(r"%Y-%m-%d")
-        
-        if current_date not in df.columns:
-            df[current_date] = False
-
-        for person in df.index:
-            df.at[person, current_date] = results.get(person, '✗')
-        
-        # Save DataFrame to Excel with formatting
-        with pd.ExcelWriter(self.file_path, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name=class_id)
-
-            # Auto-adjust columns' width
-            for column in df:
-                column_width = max(df[column].astype(str).map(len).max(), len(column))
-                col_idx = df.columns.get_loc(column)
-                writer.sheets[class_id].set_column(col_idx, col_idx, column_width + 1)  # add a little extra width
-
-        return df
+import os
+import re
+import threading
+from contextlib import nullcontext
+import pandas as pd
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from embedding_cache import EmbeddingCache
+from attendance_store import AttendanceStore
+from face_matcher import FaceMatcher, build_prototypes
+from quantized_gallery import QuantizedGallery
+from shared_gallery import SharedGallery
+from result_cache import AnchorResultCache
+from face_backends import FaceBackend
+from image_loading import load_image
+from instrumentation import RunRecorder
+from video_attendance import VideoAttendance, is_video
+
+
+picture_extensions = ('.jpg', '.jpeg', '.png')
+
+
+def student_name(picture):
+    """Name of the student in a picture, given by its path relative to the students' pictures folder.
+    Pictures in a per-student sub folder are named after the folder, other pictures after the file name
+    without its extension and its optional '__<number>' suffix (John_Doe__2.jpg is John Doe)."""
+    folder, filename = os.path.split(picture)
+    label = folder if folder else re.sub(r"__\d+$", "", os.path.splitext(filename)[0])
+    return label.replace("_", " ").strip()
+
+
+def list_student_pictures(directory_path):
+    """Returns the paths, relative to directory_path, of the students' pictures in the folder
+    and in its per-student sub folders."""
+    pictures = []
+    for entry in os.listdir(directory_path):
+        path = os.path.join(directory_path, entry)
+        if os.path.isdir(path) and not entry.startswith('.'):
+            pictures.extend(os.path.join(entry, filename) for filename in sorted(os.listdir(path))
+                            if filename.lower().endswith(picture_extensions))
+        elif entry.lower().endswith(picture_extensions):
+            pictures.append(entry)
+    return pictures
+
+
+class RecognitionCancelled(Exception):
+    """Raised inside a recognition run when the user asked to stop it."""
+
+
+def encode_picture(image_path, backend):
+    """Decodes and encodes one student's picture, returns None when no face was found.
+    Defined at module level so it can run in the enrollment worker processes."""
+    rgb_image = load_image(image_path, FaceRecognitionManager.roster_max_side)
+    if rgb_image is None:
+        return None
+
+    encodings = backend.encode_all(rgb_image)
+    return encodings[0] if encodings else None
+
+
+class FaceRecognitionManager:
+    # Oversized images are decoded at reduced scale, keeping their longest side at least this many pixels
+    roster_max_side = 1024
+    anchor_max_side = 4096
+
+    def __init__(self, directory_path, anchor_image_path, file_path, use_cache=True, tolerance=None, workers=None,
+                 detection_max_side=None, upsample_region=None, profile=None, detector_model_path=None, backend=None,
+                 gallery_storage=None):
+        self.directory_path = directory_path
+        self.anchor_image_path = anchor_image_path
+        self.file_path = file_path
+        self.known_faces = {}
+        self.roster_loaded = False  # the roster is loaded once and reused across anchor images
+        # Detector and encoder, chosen by the speed/accuracy profile of the class unless given explicitly
+        self.backend = backend or FaceBackend.from_profile(profile, detection_max_side, upsample_region,
+                                                           detector_model_path)
+        # Persistent embeddings of the students' pictures, so unchanged pictures are not encoded again
+        self.cache = EmbeddingCache(directory_path, backend_tag=self.backend.tag) if use_cache else None
+        # Faces found in the class photos already processed, so the same photo is not detected and encoded twice
+        self.result_cache = AnchorResultCache() if use_cache else None
+        self.matcher = FaceMatcher(tolerance)
+        # Storage of the roster matrix (float32, float16 or int8), None keeps the float64 prototypes
+        self.gallery_storage = gallery_storage
+        self.gallery = None
+        self.shared_gallery = None  # the published gallery the process is attached to
+        # Number of enrollment worker processes, defaults to one per core
+        self.workers = workers or os.cpu_count() or 1
+        self.unrecognized_files = []  # students' pictures in which no face was found
+        # Optional callable(stage, done, total) informed of the progress of a run
+        self.progress = None
+        # Set from another thread to stop the run at the next stage boundary
+        self.cancel_event = threading.Event()
+        # Optional RunRecorder collecting the timing and resources of each stage
+        self.recorder = None
+
+    @classmethod
+    def from_settings(cls, settings, anchor_image_path=None):
+        """Creates the manager of a class from its ClassConfig."""
+        return cls(settings.directory_path, anchor_image_path, settings.excel_file_path,
+                   tolerance=settings.tolerance, workers=settings.workers,
+                   detection_max_side=settings.detection_max_side, upsample_region=settings.upsample_region,
+                   profile=settings.profile, detector_model_path=settings.detector_model_path,
+                   gallery_storage=settings.gallery_storage)
+
+    def close(self):
+        """Stops the worker processes the backend keeps across photos, see TiledDetector."""
+        self.backend.close()
+
+    def start_run(self, **run_info):
+        """Starts recording the stages of a new run, see RunRecorder."""
+        if self.backend.fallback:
+            run_info['detector_fallback'] = self.backend.fallback
+        self.recorder = RunRecorder(directory_path=self.directory_path, backend=self.backend.tag, **run_info)
+        return self.recorder
+
+    def stage(self, name):
+        """Context manager timing a stage of the run when a recorder is attached, yields the stage counters."""
+        return self.recorder.stage(name) if self.recorder is not None else nullcontext({})
+
+    def report(self, stage, done=0, total=0):
+        """Reports the progress of the current stage and stops the run if it was cancelled."""
+        if self.cancel_event.is_set():
+            raise RecognitionCancelled(stage)
+        if self.progress is not None:
+            self.progress(stage, done, total)
+
+    def detect_faces(self):
+        """Loads the anchor image and detects the faces in it, once, with the backend's detector.
+        The locations are returned in full resolution coordinates."""
+        self.report("Detecting faces")
+        with self.stage("load_image") as stats:
+            # Tiled detection needs the small faces of panoramas at full resolution
+            max_side = None if self.backend.detector.full_resolution else self.anchor_max_side
+            anchor_image = load_image(self.anchor_image_path, max_side)
+            if anchor_image is None:
+                raise FileNotFoundError(f"Cannot read the image {self.anchor_image_path}")
+            stats['image_size'] = list(anchor_image.shape[:2])
+        with self.stage("detect") as stats:
+            face_locations = self.backend.detector.locate(anchor_image)
+            stats['faces'] = len(face_locations)
+        return anchor_image, face_locations
+
+    def crop_faces(self):
+        """Crops faces from the anchor image, as views of it rather than copies."""
+        anchor_image, face_locations = self.detect_faces()
+        return [anchor_image[top:bottom, left:right] for top, right, bottom, left in face_locations]
+
+    def encode_faces(self):
+        """Encodes every face of the anchor image in one batched call on the full image,
+        reusing the detected locations instead of detecting again on each crop.
+        A photo already processed with the same settings is taken from the result cache.
+        When the anchor is a video clip, returns one encoding per face tracked in it."""
+        if is_video(self.anchor_image_path):
+            with self.stage("encode_video") as stats:
+                video = VideoAttendance(self)
+                face_encodings = video.encode(self.anchor_image_path)
+                stats.update(video.stats)
+            return face_encodings
+
+        key = None
+        if self.result_cache is not None:
+            with self.stage("result_cache") as stats:
+                key = self.result_cache.key(self.anchor_image_path, {**self.backend.settings,
+                                                                     'anchor_max_side': self.anchor_max_side})
+                cached = self.result_cache.get(key)
+                stats.update(hit=cached is not None, hits=self.result_cache.hits, misses=self.result_cache.misses)
+            if cached is not None:
+                return cached[1]
+
+        anchor_image, face_locations = self.detect_faces()
+        self.report("Encoding faces", 0, len(face_locations))
+        with self.stage("encode") as stats:
+            face_encodings = self.backend.encoder.encode(anchor_image, face_locations)
+            stats['faces'] = len(face_encodings)
+        if key is not None:
+            self.result_cache.put(key, face_locations, face_encodings)
+        return face_encodings
+
+    def load_known_faces(self, rebuild=False):
+        """loading and embedding the students' pictures into the known_face variable,
+        reusing the cached embedding of every picture that did not change since the last run"""
+        with self.stage("load_roster") as stats:
+            if self.cache is not None:
+                if rebuild:
+                    self.cache.clear()
+                else:
+                    self.cache.load()
+
+            filenames = list_student_pictures(self.directory_path)
+
+            encodings, pending = {}, []
+            for filename in filenames:
+                entry = self.cache.lookup(filename) if self.cache is not None else None
+                if entry is not None:
+                    encodings[filename] = entry['encoding']
+                else:
+                    pending.append(filename)
+
+            self.report("Loading students' pictures", len(filenames) - len(pending), len(filenames))
+            try:
+                first = len(filenames) - len(pending) + 1
+                for done, (filename, encoding) in enumerate(self.encode_pictures(pending), first):
+                    encodings[filename] = encoding
+                    if self.cache is not None:
+                        self.cache.update(filename, encoding)
+                    self.report("Loading students' pictures", done, len(filenames))
+            finally:
+                # Keep what was already encoded, even when the run is cancelled half way
+                if self.cache is not None:
+                    self.cache.save()
+
+            # Keep the directory order so the result doesn't depend on which worker finished first
+            student_encodings, self.unrecognized_files = {}, []
+            for filename in filenames:
+                if encodings[filename] is None:
+                    self.unrecognized_files.append(filename)
+                    continue
+                student_encodings.setdefault(student_name(filename), []).append(encodings[filename])
+
+            # A few prototypes per student, so matching cost grows with students rather than pictures
+            self.known_faces = {name: build_prototypes(student) for name, student in student_encodings.items()}
+            if self.gallery_storage:
+                if self.cache is not None:
+                    # Published next to the cache, other processes attach to it instead of loading the roster.
+                    # Attached processes remap their files on every publication, only publish a changed roster
+                    digest = QuantizedGallery.digest(self.known_faces, self.gallery_storage)
+                    self.shared_gallery = SharedGallery(self.gallery_path())
+                    if self.shared_gallery.current() is None or self.shared_gallery.info.get('roster') != digest:
+                        self.shared_gallery.publish(QuantizedGallery(self.known_faces, self.gallery_storage),
+                                                    roster=digest, unrecognized_files=self.unrecognized_files)
+                    self.gallery = self.shared_gallery.current()
+                else:
+                    self.gallery = QuantizedGallery(self.known_faces, self.gallery_storage)
+                self.known_faces = self.gallery.known_faces()
+                stats.update(gallery_storage=self.gallery_storage, gallery_bytes=self.gallery.nbytes,
+                             gallery_scanned_bytes=self.gallery.scanned_nbytes)
+            else:
+                self.gallery = self.shared_gallery = None
+
+            if self.cache is not None:
+                self.cache.prune(filenames)
+                self.cache.save()
+            stats.update(pictures=len(filenames), students=len(self.known_faces), encoded=len(pending),
+                         without_face=len(self.unrecognized_files))
+            if self.unrecognized_files:
+                # Shown to the user by the GUI and the batch summary, only logged here
+                stats['unrecognized_files'] = self.unrecognized_files
+            if self.cache is not None:
+                stats.update(cache_hits=len(filenames) - len(pending))
+        self.roster_loaded = True
+        
+    def gallery_path(self):
+        return os.path.join(self.directory_path, f".face_gallery.{self.backend.tag}")
+
+    def attach_gallery(self):
+        """Attaches to the gallery another process published for the class, memory-mapped, instead of
+        loading the roster. Returns False when none was published, see gallery_storage."""
+        shared_gallery = SharedGallery(self.gallery_path())
+        if shared_gallery.current() is None:
+            return False
+        self.shared_gallery = shared_gallery
+        self.use_gallery(shared_gallery.current())
+        self.roster_loaded = True
+        return True
+
+    def use_gallery(self, gallery):
+        self.gallery = gallery
+        self.known_faces = gallery.known_faces()
+        self.unrecognized_files = self.shared_gallery.info.get('unrecognized_files', [])
+
+    def encode_pictures(self, filenames):
+        """Yields (filename, encoding) for each student's picture as soon as it is encoded,
+        spreading the decoding and encoding over a pool of worker processes."""
+        paths = {filename: os.path.join(self.directory_path, filename) for filename in filenames}
+        backend = self.backend.roster_backend()
+
+        if self.workers <= 1 or len(filenames) <= 1:
+            for filename in filenames:
+                yield filename, encode_picture(paths[filename], backend)
+            return
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(filenames))) as executor:
+            futures = {executor.submit(encode_picture, paths[filename], backend): filename for filename in filenames}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # Drop the queued pictures when the run is cancelled or fails half way
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def compare_faces(self, face_encodings, assigned_faces=False):
+        """Compares the encoded faces of the anchor image to known faces in the directory.
+        Returns the ✓/✗ result and the distance of the closest face for every student, and with
+        assigned_faces the index of the face recognized as each present student."""
+        return self.compare_faces_many([face_encodings], assigned_faces)[0]
+
+    def compare_faces_many(self, photos_encodings, assigned_faces=False):
+        """Same as compare_faces for the faces of several photos of the class, matched with a single
+        distance matrix. Returns the (results, distances) of each photo."""
+        if not self.roster_loaded:
+            self.load_known_faces()
+        faces = sum(len(face_encodings) for face_encodings in photos_encodings)
+        self.report("Matching faces", faces, faces)
+        with self.stage("match") as stats:
+            stats.update(faces=faces, roster=len(self.known_faces))
+            if self.shared_gallery is not None and self.shared_gallery.current() is not self.gallery:
+                self.use_gallery(self.shared_gallery.current())  # re-enrolled by another process
+            if self.gallery is not None:
+                return self.matcher.match_gallery_many(photos_encodings, self.gallery, assigned_faces)
+            return self.matcher.match_many(photos_encodings, self.known_faces, assigned_faces)
+    
+    def load_dataframe(self, class_id=None):
+        """Loads the attendance DataFrame of the class from the Excel file, or creates it from the students' pictures.
+        Raises PermissionError when the Excel file is open in another program."""
+        if os.path.isfile(self.file_path):
+            # Fails when the Excel file is already open
+            with open(self.file_path, 'r+b') as _:
+                pass
+            sheets = pd.read_excel(self.file_path, sheet_name=None, index_col=0)
+            df = sheets[class_id] if class_id in sheets else next(iter(sheets.values()))
+            df.columns = pd.to_datetime(df.columns).strftime(r"%Y-%m-%d")
+            return df
+
+        names = dict.fromkeys(student_name(picture) for picture in list_student_pictures(self.directory_path))
+        file_names = [name.capitalize() for name in sorted(names, key=lambda label: ord(label[0]))]
+        if not file_names:
+            raise FileNotFoundError(f"No students' pictures found in {self.directory_path}")
+        return pd.DataFrame(index=file_names)
+
+    def update_attendance(self, results, class_id, export_excel=False):
+        """Appends today's recognition results to the attendance store. The class sheet is exported to
+        Excel only when asked, rewriting the workbook costs more with every day of history."""
+        self.report("Writing attendance")
+        with self.stage("write") as stats:
+            store = AttendanceStore.for_excel_file(self.file_path)
+
+            if not store.has_class(class_id):
+                # First run with the store, carry over the attendance already kept in the Excel file
+                store.import_dataframe(class_id, self.load_dataframe(class_id))
+
+            store.record(class_id, date.today().strftime(r"%Y-%m-%d"), results)
+            stats['students'] = len(results)
+
+            if export_excel:
+                return store.export_excel(self.file_path, class_id)
@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class GalleryIndex:
+    """Searchable index of the students' embeddings of every configured class.
+
+    Search is exact (one matrix product over the whole gallery) or approximate: the gallery is split
+    into partitions around k-means centroids and only the partitions closest to the query are scanned.
+    Students can be inserted, updated and removed without rebuilding the index.
+    """
+    encoding_size = 128
+    # Below this many students an exact scan is as fast as the partitions
+    min_partitioned_size = 1024
+
+    def __init__(self, backend_tag=None, probes=4):
+        self.backend_tag = backend_tag
+        self.probes = probes  # partitions scanned per query in approximate search
+        self.keys = []  # (class_id, name) of every row, None for removed rows
+        self.rows = {}  # (class_id, name) -> row
+        self.free_rows = []
+        self._matrix = np.zeros((64, self.encoding_size), dtype=np.float32)
+        self._norms = np.zeros(64, dtype=np.float32)
+        self.centroids = None
+        self.partitions = []  # row indices of each partition
+        self.row_partition = {}  # row -> partition
+        self._built_size = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_config(cls, config_manager, profile=None, workers=None):
+        """Builds the index from the students' pictures of every class in the configuration.
+        All classes are encoded with the same profile, so their embeddings are comparable."""
+        from face_recognition_manager import FaceRecognitionManager
+
+        index = None
+        for class_id in config_manager.load_config():
+            try:
+                settings = config_manager.get_class_settings(class_id)
+            except ValueError:
+                continue
+            face_manager = FaceRecognitionManager(settings.directory_path, None, settings.excel_file_path,
+                                                  workers=workers or settings.workers, profile=profile,
+                                                  detector_model_path=settings.detector_model_path)
+            if index is None:
+                index = cls(face_manager.backend.tag)
+            face_manager.load_known_faces()
+            index.sync_class(class_id, face_manager.known_faces)
+
+        index = index or cls()
+        index.build()
+        return index
+
+    def add(self, class_id, name, encoding):
+        """Inserts a student, or replaces the embedding of an existing one."""
+        key = (class_id, name)
+        if key in self.rows:
+            self.remove(class_id, name)
+
+        row = self.free_rows.pop() if self.free_rows else len(self.keys)
+        if row == len(self.keys):
+            self.keys.append(None)
+            if row >= len(self._matrix):
+                # Grow by doubling so inserts stay amortized O(1)
+                self._matrix = np.resize(self._matrix, (2 * len(self._matrix), self.encoding_size))
+                self._norms = np.resize(self._norms, 2 * len(self._norms))
+
+        self._matrix[row] = encoding
+        self._norms[row] = float(np.dot(self._matrix[row], self._matrix[row]))
+        self.keys[row] = key
+        self.rows[key] = row
+
+        if self.centroids is not None:
+            partition = int(np.argmin(((self.centroids - self._matrix[row]) ** 2).sum(axis=1)))
+            self.partitions[partition].append(row)
+            self.row_partition[row] = partition
+            if len(self.rows) > 2 * self._built_size:
+                self.build()  # the partitions no longer reflect the gallery
+
+    def remove(self, class_id, name):
+        """Removes a student from the index, if present."""
+        row = self.rows.pop((class_id, name), None)
+        if row is None:
+            return
+        self.keys[row] = None
+        self.free_rows.append(row)
+        partition = self.row_partition.pop(row, None)
+        if partition is not None:
+            self.partitions[partition].remove(row)
+
+    def sync_class(self, class_id, known_faces):
+        """Brings the students of a class up to date with its roster: adds and updates the given
+        embeddings and removes the students no longer in it."""
+        for key in [key for key in self.rows if key[0] == class_id and key[1] not in known_faces]:
+            self.remove(*key)
+        for name, encoding in known_faces.items():
+            encoding = np.atleast_2d(encoding)[0]  # a student's first prototype is the centroid of their pictures
+            row = self.rows.get((class_id, name))
+            if row is None or not np.array_equal(self._matrix[row], np.asarray(encoding, dtype=np.float32)):
+                self.add(class_id, name, encoding)
+
+    def build(self, partitions=None, iterations=10):
+        """Splits the gallery into partitions with k-means, for approximate search.
+        Small galleries are left unpartitioned and always searched exactly."""
+        live_rows = np.array(sorted(self.rows.values()), dtype=int)
+        self._built_size = len(live_rows)
+        if len(live_rows) < self.min_partitioned_size:
+            self.centroids, self.partitions, self.row_partition = None, [], {}
+            return
+
+        vectors = self._matrix[live_rows]
+        count = partitions or int(np.sqrt(len(live_rows)))
+        rng = np.random.default_rng(0)  # deterministic partitions
+        centroids = vectors[rng.choice(len(vectors), count, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._nearest(vectors, centroids)
+            for partition in range(count):
+                members = vectors[assignment == partition]
+                if len(members):
+                    centroids[partition] = members.mean(axis=0)
+
+        assignment = self._nearest(vectors, centroids)
+        self.centroids = centroids
+        self.partitions = [live_rows[assignment == partition].tolist() for partition in range(count)]
+        self.row_partition = dict(zip(live_rows.tolist(), assignment.tolist()))
+
+    @staticmethod
+    def _nearest(vectors, centroids):
+        squared = (centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        return squared.argmin(axis=1)
+
+    def _distances(self, query, rows):
+        """Euclidean distances from the query to the given rows, |a - b|^2 = |a|^2 + |b|^2 - 2ab."""
+        squared = self._norms[rows] + float(np.dot(query, query)) - 2 * (self._matrix[rows] @ query)
+        return np.sqrt(np.maximum(squared, 0))
+
+    def search(self, encodings, k=1, exact=False):
+        """Returns, for every query embedding, its k nearest students as (class_id, name, distance)."""
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.encoding_size)
+        all_rows = np.array(sorted(self.rows.values()), dtype=int)
+        matches = []
+
+        for query in queries:
+            if exact or self.centroids is None:
+                rows = all_rows
+            else:
+                nearest = np.argsort(((self.centroids - query) ** 2).sum(axis=1))[:self.probes]
+                rows = np.array([row for partition in nearest for row in self.partitions[partition]], dtype=int)
+
+            if len(rows) == 0:
+                matches.append([])
+                continue
+
+            distances = self._distances(query, rows)
+            best = np.argsort(distances)[:k] if len(rows) <= k else np.argpartition(distances, k)[:k]
+            best = best[np.argsort(distances[best])]
+            matches.append([(*self.keys[rows[i]], float(distances[i])) for i in best])
+
+        return matches
+
+    def identify(self, encodings, tolerance=0.6, exact=False):
+        """Returns the closest student within tolerance of every face, as (class_id, name, distance), or None."""
+        return [found[0] if found and found[0][2] <= tolerance else None
+                for found in self.search(encodings, k=1, exact=exact)]
@@ -0,0 +1,44 @@
+import cv2
+
+try:
+    from PIL import Image  # optional, reads the image size from the header without decoding
+except ImportError:
+    Image = None
+
+# OpenCV decodes JPEGs directly at 1/2, 1/4 or 1/8 scale, which is much cheaper than decoding and resizing
+reduced_flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def image_size(path):
+    """Returns (width, height) read from the image header, or None when it can't be read cheaply."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except OSError:
+        return None
+
+
+def decode_reduction(size, max_side):
+    """Largest of 1, 2, 4 and 8 that keeps the longest side of the decoded image at or above max_side."""
+    reduction = 1
+    if size and max_side:
+        while reduction < 8 and max(size) / (reduction * 2) >= max_side:
+            reduction *= 2
+    return reduction
+
+
+def load_image(path, max_side=None):
+    """Decodes an image file into an RGB array.
+
+    Oversized images are decoded at reduced scale, keeping the longest side at least max_side pixels.
+    The EXIF orientation is applied by OpenCV, so portrait phone photos are not detected sideways, and
+    the color is converted exactly once, in place. Returns None when the file can't be decoded.
+    """
+    flags = reduced_flags[decode_reduction(image_size(path), max_side)]
+    image = cv2.imread(path, flags)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
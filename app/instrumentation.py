@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import cProfile
+from datetime import datetime
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+try:
+    import psutil  # optional, gives the peak memory on Windows
+except ImportError:
+    psutil = None
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of the process so far in MB, or None when it can't be measured."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024), 1)
+    return None
+
+
+class RunRecorder:
+    """Records the wall time, peak memory and counters of every stage of one recognition run,
+    and writes them as one JSON line to a rotating log once the run is over."""
+    # Default location of the run log, relative to the working directory
+    log_path = os.path.join("logs", "recognition_runs.jsonl")
+    max_log_bytes = 1024 * 1024
+    log_backups = 5
+    # When this environment variable names a folder, each run is profiled and the profile is saved there
+    profile_env_var = "FACE_ATTENDANCE_PROFILE"
+
+    _loggers = {}
+
+    def __init__(self, log_path=None, profile_dir=None, **run_info):
+        self.log_path = log_path or self.log_path
+        self.profile_dir = profile_dir or os.environ.get(self.profile_env_var)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.run_info = run_info
+        self.stages = []
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+
+        self.profiler = None
+        if self.profile_dir:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @classmethod
+    def logger(cls, log_path):
+        """Returns the logger writing to log_path, created once per file."""
+        if log_path not in cls._loggers:
+            directory = os.path.dirname(log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            logger = logging.getLogger(f"face_attendance.runs.{len(cls._loggers)}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(log_path, maxBytes=cls.max_log_bytes, backupCount=cls.log_backups,
+                                          encoding='utf-8')
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            cls._loggers[log_path] = logger
+        return cls._loggers[log_path]
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block. The yielded dict collects the counters of the stage."""
+        counters = {}
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.stages.append({
+                'stage': name,
+                'seconds': round(time.perf_counter() - start, 4),
+                'peak_rss_mb': peak_rss_mb(),
+                **counters,
+            })
+
+    def finish(self, status="ok", **extra):
+        """Writes the record of the run to the log, and the profile when profiling is on."""
+        record = {
+            'run_id': self.run_id,
+            'started_at': self.started_at,
+            'status': status,
+            'seconds': round(time.perf_counter() - self.started, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            **self.run_info,
+            **extra,
+            'stages': self.stages,
+        }
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            record['profile'] = os.path.join(self.profile_dir, f"run-{self.run_id}.prof")
+            self.profiler.dump_stats(record['profile'])
+
+        self.logger(self.log_path).info(json.dumps(record, ensure_ascii=False, default=str))
+        return record
+
+
+class StartupTimer:
+    """Measures the time from the start of the app to its milestones, such as the first window,
+    the models being warm and the first result. Each milestone is passed to the registered hooks once."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.milestones = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """Registers a callable(milestone, seconds) called when a milestone is reached."""
+        self.hooks.append(hook)
+
+    def mark(self, milestone):
+        if milestone in self.milestones:
+            return  # only the first time counts
+        seconds = round(time.perf_counter() - self.started, 4)
+        self.milestones[milestone] = seconds
+        for hook in self.hooks:
+            hook(milestone, seconds)
+
+
+def log_event(event, **fields):
+    """Writes an event that is not a recognition run, such as a startup milestone, to the run log."""
+    record = {'event': event, **fields, 'pid': os.getpid()}
+    RunRecorder.logger(RunRecorder.log_path).info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def log_startup_milestone(milestone, seconds):
+    """Startup timing hook writing the milestones to the run log."""
+    log_event('startup', milestone=milestone, seconds=seconds)
+
+
+# Timer of this process, started when the module is first imported
+startup_timer = StartupTimer()
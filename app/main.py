@@ -5,8 +5,11 @@ from tkinter.font import Font
 from tkinter import messagebox, ttk
 
 # Custom modules for different windows and features in the app
+# (the recognition window is imported on demand, it pulls in the heavy face recognition modules)
+from instrumentation import startup_timer, log_startup_milestone
+from config_manager import ConfigManager
+from model_warmup import ModelWarmup
 from class_id_setup import ClassIDSetupWindow
-from recognition_window import RecognitionWindow
 from centered_application import ApplicationPosition
 from show_app_info import ApplicationInstructionManual
 
@@ -26,6 +29,14 @@ class MainApplication:
 
         self.setup_ui()
 
+        # Load the models in the background as soon as the window is shown
+        self.warmup = ModelWarmup(ConfigManager())
+        master.after_idle(self.on_first_window)
+
+    def on_first_window(self):
+        startup_timer.mark("first_window")
+        self.warmup.start()
+
     def setup_ui(self):
         # Configure grid columns
         self.master.grid_columnconfigure(0, weight=1)
@@ -58,8 +69,10 @@ class MainApplication:
 
     def start_face_recognition(self):
         # Start the face recognition feature
+        from recognition_window import RecognitionWindow
+
         self.master.withdraw()
-        RecognitionWindow(self.master, self.open_excel_file)
+        RecognitionWindow(self.master, self.open_excel_file, self.warmup)
 
     def rerendering(self, top):
         top.destroy()
@@ -78,6 +91,7 @@ class MainApplication:
             messagebox.showerror("Error", f"Failed to open Excel file: {e}")
 
 if __name__ == "__main__":
+    startup_timer.add_hook(log_startup_milestone)
     root = tk.Tk()
     app = MainApplication(root)
     root.mainloop()
@@ -0,0 +1,76 @@
+import threading
+from collections import deque
+from instrumentation import startup_timer, log_event
+
+
+class ModelWarmup:
+    """Loads the heavy modules and models and preloads the roster embeddings on a background thread,
+    while the user is still choosing a class and a photo. The managers of the classes are kept, with
+    their roster loaded, for the recognition window to take."""
+    poll_interval = 0.1  # seconds between two checks of the cancel event while waiting for a class
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.ready = threading.Event()
+        self.thread = None
+        self.condition = threading.Condition()
+        self.managers = {}  # class ID -> (settings, manager) warmed up and not taken yet
+        self.queue = None  # class IDs still to warm up, None until the configuration is read
+        self.warming = None  # class ID being warmed up
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="model-warmup", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        try:
+            # Importing the manager pulls in pandas, OpenCV and face_recognition, which loads the dlib models
+            from face_recognition_manager import FaceRecognitionManager
+            startup_timer.mark("models_ready")
+
+            with self.condition:
+                self.queue = deque(self.config_manager.load_config())
+
+            # Load every class's roster, bringing its embedding cache up to date
+            while True:
+                with self.condition:
+                    if not self.queue: break
+                    class_id = self.warming = self.queue.popleft()
+                warmed = None
+                try:
+                    settings = self.config_manager.get_class_settings(class_id)
+                    face_manager = FaceRecognitionManager.from_settings(settings)
+                    face_manager.load_known_faces()
+                    warmed = settings, face_manager
+                except Exception as e:  # a broken class must not stop the warm-up of the others
+                    # The GUI has no console, the failure goes to the run log
+                    log_event('warmup', class_id=class_id, status='error', error=f"{type(e).__name__}: {e}")
+                with self.condition:
+                    if warmed is not None:
+                        self.managers[class_id] = warmed
+                    self.warming = None
+                    self.condition.notify_all()
+            startup_timer.mark("rosters_ready")
+        finally:
+            with self.condition:
+                self.warming = None
+                self.ready.set()
+                self.condition.notify_all()
+
+    def take(self, class_id, settings, cancel_event=None):
+        """Returns the manager of the class with its roster loaded, or None when it wasn't warmed up with
+        these settings. Only waits while the class itself is warming up: a class still queued is left to
+        the caller, which loads its roster sooner than the warm-up would after the classes before it.
+        Each manager is taken once, later runs load the roster from the up to date embedding cache."""
+        if self.thread is None:
+            return None
+        with self.condition:
+            while not (self.ready.is_set() or (self.queue is not None and self.warming != class_id)):
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                self.condition.wait(self.poll_interval)
+            if self.queue and class_id in self.queue:
+                self.queue.remove(class_id)
+            warmed_settings, face_manager = self.managers.pop(class_id, (None, None))
+        return face_manager if warmed_settings == settings else None
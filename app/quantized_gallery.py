@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class QuantizedGallery:
+    """The prototypes of a class's students in one contiguous matrix, stored as float64, float32,
+    float16 or int8 (one scale per row), with the name and first row of every student.
+
+    Distances are computed on the stored form. Only the prototypes whose distance lands within
+    recheck_margin of the tolerance are recomputed from the full precision rows. A saved gallery is
+    loaded memory-mapped, so processes loading the same files share its pages and only the rechecked
+    full precision rows are ever read. A gallery built in memory holds its full precision rows too,
+    see nbytes and scanned_nbytes.
+    """
+    encoding_size = 128
+    storages = ('float64', 'float32', 'float16', 'int8')
+    block_rows = 4096  # prototypes dequantized at a time while matching
+
+    def __init__(self, known_faces, storage='float32', recheck_margin=0.03):
+        if storage not in self.storages:
+            raise ValueError(f"Unknown gallery storage {storage}, expected one of {', '.join(self.storages)}")
+        self.storage = storage
+        self.recheck_margin = recheck_margin
+        self.names = list(known_faces)
+        prototypes = [np.atleast_2d(known_faces[name]) for name in self.names]
+        self.starts = np.cumsum([0] + [len(student) for student in prototypes[:-1]]).astype(np.int64)
+        stacked = np.vstack(prototypes) if prototypes else np.zeros((0, self.encoding_size))
+        exact = stacked.astype(np.float32)
+        # float64 galleries are the reference path, computed in float64 end to end
+        self.compute_dtype = np.float64 if storage == 'float64' else np.float32
+        self.rows = self.student_rows(self.names, self.starts, len(stacked))
+
+        self.scales = None
+        if storage == 'int8':
+            self.scales = np.maximum(np.abs(exact).max(axis=1), 1e-12) / 127
+            self.matrix = np.round(exact / self.scales[:, None]).astype(np.int8)
+            self.scales = self.scales.astype(np.float32)
+        else:
+            self.matrix = np.ascontiguousarray(stacked, dtype=storage)
+        # Norms of the stored rows, so the approximate distances are consistent with the stored form
+        self.norms = (self.dequantize(0, len(self.matrix)) ** 2).sum(axis=1)
+
+        # The stored rows are the full precision ones for float64 and float32
+        self.exact = exact if storage in ('float16', 'int8') else None
+        self.rechecked = 0  # prototype distances recomputed at full precision so far
+
+    @staticmethod
+    def digest(known_faces, storage):
+        """Identifies the gallery the prototypes would give in the given storage, to tell whether a
+        published gallery is still up to date."""
+        digest = hashlib.sha256(storage.encode('utf-8'))
+        for name, prototypes in known_faces.items():
+            digest.update(name.encode('utf-8'))
+            digest.update(np.ascontiguousarray(prototypes, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def student_rows(names, starts, total):
+        starts = np.asarray(starts).tolist()  # one read of the memory-mapped starts
+        return dict(zip(names, zip(starts, starts[1:] + [total])))
+
+    def save(self, directory):
+        """Writes the gallery as one .npy file per array plus index.json holding the names and first rows."""
+        os.makedirs(directory, exist_ok=True)
+        arrays = {'matrix': self.matrix, 'norms': self.norms, 'starts': self.starts, 'scales': self.scales,
+                  'exact': self.exact}
+        for name, array in arrays.items():
+            if array is not None:
+                np.save(os.path.join(directory, f"{name}.npy"), np.asarray(array))
+        index = {'storage': self.storage, 'recheck_margin': self.recheck_margin, 'names': self.names,
+                 'arrays': [name for name, array in arrays.items() if array is not None]}
+        with open(os.path.join(directory, "index.json"), 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        """Loads a saved gallery with its arrays memory-mapped read-only, without copying them."""
+        with open(os.path.join(directory, "index.json"), encoding='utf-8') as index_file:
+            index = json.load(index_file)
+
+        gallery = cls.__new__(cls)
+        gallery.storage = index['storage']
+        gallery.recheck_margin = index['recheck_margin']
+        gallery.names = index['names']
+        gallery.compute_dtype = np.float64 if gallery.storage == 'float64' else np.float32
+        for name in ('matrix', 'norms', 'starts', 'scales', 'exact'):
+            path = os.path.join(directory, f"{name}.npy")
+            setattr(gallery, name, np.load(path, mmap_mode='r') if name in index['arrays'] else None)
+        gallery.rows = cls.student_rows(gallery.names, gallery.starts, len(gallery.matrix))
+        gallery.rechecked = 0
+        return gallery
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def nbytes(self):
+        """Size of all the arrays of the gallery, the full precision rows of float16 and int8 included."""
+        return self.scanned_nbytes + (self.exact.nbytes if self.exact is not None else 0)
+
+    @property
+    def scanned_nbytes(self):
+        """Size of the stored matrix, its scales and norms, read by every match. Only these stay resident
+        when the gallery is memory-mapped, the full precision rows are read when rechecked."""
+        return sum(array.nbytes for array in (self.matrix, self.scales, self.norms) if array is not None)
+
+    def prototypes(self, name):
+        """Full precision prototypes of a student, a view into the gallery."""
+        start, end = self.rows[name]
+        return (self.exact if self.exact is not None else self.matrix)[start:end]
+
+    def known_faces(self):
+        """The gallery as a name -> prototypes dict, without copying the rows."""
+        return {name: self.prototypes(name) for name in self.names}
+
+    def dequantize(self, start, end):
+        rows = self.matrix[start:end].astype(self.compute_dtype)
+        if self.scales is not None:
+            rows *= self.scales[start:end, None]
+        return rows
+
+    def prototype_distances(self, face_encodings, tolerance):
+        """Faces x prototypes distances computed on the stored form, borderline ones rechecked."""
+        faces = np.asarray(face_encodings, dtype=self.compute_dtype).reshape(-1, self.encoding_size)
+        face_norms = (faces ** 2).sum(axis=1)[:, None]
+        distances = np.empty((len(faces), len(self.matrix)), dtype=self.compute_dtype)
+        for start in range(0, len(self.matrix), self.block_rows):
+            end = min(start + self.block_rows, len(self.matrix))
+            squared = face_norms + self.norms[None, start:end] - 2 * faces @ self.dequantize(start, end).T
+            distances[:, start:end] = np.sqrt(np.maximum(squared, 0))
+
+        if self.exact is not None:
+            # Quantization error only matters where it could flip the ✓/✗ decision
+            faces_index, rows = np.nonzero(np.abs(distances - tolerance) <= self.recheck_margin)
+            if len(rows):
+                unique_rows = np.unique(rows)
+                exact_rows = np.asarray(self.exact[unique_rows], dtype=np.float64)
+                differences = faces[faces_index].astype(np.float64) - exact_rows[np.searchsorted(unique_rows, rows)]
+                distances[faces_index, rows] = np.sqrt((differences ** 2).sum(axis=1))
+                self.rechecked += len(rows)
+        return distances
+
+    def student_distances(self, face_encodings, tolerance):
+        """Faces x students distances, each student's closest prototype counting."""
+        distances = self.prototype_distances(face_encodings, tolerance)
+        if distances.shape[0] == 0 or not self.names:
+            return np.zeros((distances.shape[0], len(self.names)))
+        return np.minimum.reduceat(distances, self.starts, axis=1).astype(np.float64)
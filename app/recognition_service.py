@@ -0,0 +1,306 @@
+"""Local recognition service keeping the models and the classes' rosters resident.
+
+Bound to localhost only. Concurrent requests are gathered into micro-batches: the faces of all the
+photos of a class in a batch are matched against its roster with a single distance matrix.
+
+Example usage:
+    python recognition_service.py --port 8765
+    curl -X POST localhost:8765/recognize -d '{"class_id": "7A", "photo_path": "/photos/7A.jpg"}'
+    curl localhost:8765/stats
+"""
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config_manager import ConfigManager
+from attendance_store import ExcelExportScheduler
+
+default_port = 8765
+
+
+class ServiceJob:
+    """A request waiting for the batch worker."""
+
+    def __init__(self, kind, payload):
+        self.kind = kind
+        self.payload = payload
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RecognitionService:
+    """Keeps one FaceRecognitionManager per class with its roster loaded, and serves the requests
+    from a single worker thread in micro-batches."""
+
+    def __init__(self, config_manager, batch_window=0.02, max_batch=16, history=1000, export_delay=60.0):
+        self.config_manager = config_manager
+        # Excel sheets are exported on request, or after export_delay for the updates that didn't ask
+        self.exporter = ExcelExportScheduler(export_delay)
+        self.batch_window = batch_window  # seconds to wait for more requests once one arrived
+        self.max_batch = max_batch
+        self.managers = {}
+        self.jobs = queue.Queue()
+        self.latencies = {}  # endpoint -> recent latencies in seconds
+        self.batch_sizes = deque(maxlen=history)
+        self.history = history
+        self.stats_lock = threading.Lock()
+        self.worker = threading.Thread(target=self.batch_loop, name="recognition-batches", daemon=True)
+        self.worker.start()
+
+    def manager(self, class_id, reload=False):
+        """Returns the resident manager of the class, loading its roster the first time."""
+        from face_recognition_manager import FaceRecognitionManager
+
+        if reload or class_id not in self.managers:
+            if class_id in self.managers:
+                self.managers[class_id].close()
+            settings = self.config_manager.get_class_settings(class_id)
+            face_manager = FaceRecognitionManager.from_settings(settings)
+            # A published gallery is attached in milliseconds, re-enrollments always reload the roster
+            if reload or not (settings.gallery_storage and face_manager.attach_gallery()):
+                face_manager.load_known_faces()
+            self.managers[class_id] = face_manager
+        return self.managers[class_id]
+
+    def submit(self, kind, payload):
+        """Queues a request and waits for its result. Raises the error the request failed with."""
+        job = ServiceJob(kind, payload)
+        self.jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def batch_loop(self):
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0: break
+                try:
+                    batch.append(self.jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            with self.stats_lock:
+                self.batch_sizes.append(len(batch))
+            try:
+                self.run_batch(batch)
+            except Exception as e:  # one bad batch must not stop the worker, its requests fail instead
+                self.fail(batch, e)
+
+    def run_batch(self, batch):
+        # Re-enrollments first, so recognitions of the same batch see the new roster
+        for job in [job for job in batch if job.kind == "enroll"]:
+            self.run_job(job, self.enroll, job.payload['class_id'])
+
+        by_class = {}
+        for job in [job for job in batch if job.kind == "recognize"]:
+            by_class.setdefault(job.payload.get('class_id'), []).append(job)
+        for class_id, jobs in by_class.items():
+            self.recognize_batch(class_id, jobs)
+
+    @staticmethod
+    def fail(jobs, error):
+        """Fails the jobs of the list still waiting for a result."""
+        for job in jobs:
+            if not job.done.is_set():
+                job.error = error
+                job.done.set()
+
+    @staticmethod
+    def run_job(job, function, *args):
+        try:
+            job.result = function(*args)
+        except Exception as e:
+            job.error = e
+        finally:
+            job.done.set()
+
+    def enroll(self, class_id):
+        face_manager = self.manager(class_id, reload=True)
+        return {'class_id': class_id, 'students': len(face_manager.known_faces),
+                'unrecognized_files': face_manager.unrecognized_files}
+
+    def recognize_batch(self, class_id, jobs):
+        """Encodes the faces of every photo, matches them all against the class's gallery or roster at once,
+        then writes the attendance of the requests that asked for it."""
+        try:
+            face_manager = self.manager(class_id)
+        except Exception as e:
+            self.fail(jobs, e)
+            return
+
+        encoded = []
+        for job in jobs:
+            try:
+                face_manager.anchor_image_path = job.payload['photo_path']
+                encoded.append((job, face_manager.encode_faces()))
+            except Exception as e:
+                job.error = e
+                job.done.set()
+
+        # Picks up a gallery re-enrolled by another process, and matches on it like compare_faces
+        try:
+            matches = face_manager.compare_faces_many([encodings for _, encodings in encoded])
+        except Exception as e:
+            self.fail([job for job, _ in encoded], e)
+            return
+
+        for (job, encodings), (results, distances) in zip(encoded, matches):
+            def respond(job=job, encodings=encodings, results=results, distances=distances):
+                if job.payload.get('update_attendance'):
+                    export_excel = bool(job.payload.get('export_excel'))
+                    face_manager.update_attendance(results, class_id, export_excel)
+                    if not export_excel:
+                        self.exporter.schedule(face_manager.file_path, class_id)
+                return {'class_id': class_id, 'faces': len(encodings), 'results': results, 'distances': distances,
+                        'unrecognized_files': face_manager.unrecognized_files}
+            self.run_job(job, respond)
+
+    def close(self):
+        """Exports the pending Excel sheets and stops the worker processes of the resident managers."""
+        self.exporter.flush()
+        for face_manager in self.managers.values():
+            face_manager.close()
+
+    def record_latency(self, endpoint, seconds):
+        with self.stats_lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=self.history)).append(seconds)
+
+    def stats(self):
+        """Request counts and latency percentiles (in ms) of the recent requests of each endpoint."""
+        with self.stats_lock:
+            endpoints = {}
+            for endpoint, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                percentile = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+                endpoints[endpoint] = {'requests': len(ordered), 'p50_ms': percentile(0.5),
+                                       'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99)}
+            batches = list(self.batch_sizes)
+
+        return {
+            'endpoints': endpoints,
+            'batches': len(batches),
+            'mean_batch_size': round(sum(batches) / len(batches), 2) if batches else None,
+            'classes_loaded': sorted(self.managers),
+        }
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    service = None  # set by serve()
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        endpoints = {'/recognize': ('recognize', ['class_id', 'photo_path']), '/enroll': ('enroll', ['class_id'])}
+        if self.path not in endpoints:
+            self.send_json(404, {'error': f"Unknown endpoint {self.path}"})
+            return
+
+        kind, required = endpoints[self.path]
+        start = time.perf_counter()
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            missing = [field for field in required if field not in payload]
+            if missing:
+                self.send_json(400, {'error': f"Missing fields: {', '.join(missing)}"})
+                return
+            result = self.service.submit(kind, payload)
+        except (ValueError, FileNotFoundError) as e:
+            self.send_json(400, {'error': f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+        else:
+            self.send_json(200, result)
+        finally:
+            self.service.record_latency(self.path, time.perf_counter() - start)
+
+    def log_message(self, format, *args):
+        pass  # latencies are available on /stats
+
+
+def serve(config_manager, port=default_port, **service_options):
+    """Creates the HTTP server on localhost, call serve_forever() on it to start serving."""
+    handler = type('BoundServiceRequestHandler', (ServiceRequestHandler,),
+                   {'service': RecognitionService(config_manager, **service_options)})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+class RecognitionServiceClient:
+    """Client of the local recognition service, usable from the GUI or scripts."""
+    # When set, the GUI sends its recognitions to the service at this URL
+    url_env_var = "FACE_ATTENDANCE_SERVICE"
+
+    def __init__(self, base_url=f"http://127.0.0.1:{default_port}", timeout=600):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.load(e).get('error', str(e))) from e
+
+    def recognize(self, class_id, photo_path, update_attendance=False, export_excel=False):
+        return self.request('/recognize', {'class_id': class_id, 'photo_path': photo_path,
+                                           'update_attendance': update_attendance, 'export_excel': export_excel})
+
+    def enroll(self, class_id):
+        return self.request('/enroll', {'class_id': class_id})
+
+    def stats(self):
+        return self.request('/stats')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve face recognition on localhost with resident models.")
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--config', default='app_config.json', help="path to the configuration file")
+    parser.add_argument('--batch-window', type=float, default=0.02, help="seconds to gather requests in a batch")
+    parser.add_argument('--max-batch', type=int, default=16, help="maximum requests per batch")
+    parser.add_argument('--export-delay', type=float, default=60.0,
+                        help="seconds between an attendance update and the export of the class's Excel sheet")
+    args = parser.parse_args(argv)
+
+    # Load the models before accepting requests
+    import face_recognition_manager
+
+    server = serve(ConfigManager(args.config), args.port, batch_window=args.batch_window, max_batch=args.max_batch,
+                   export_delay=args.export_delay)
+    print(f"Recognition service listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+    finally:
+        server.RequestHandlerClass.service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
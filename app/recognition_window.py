@@ -1,16 +1,23 @@
 import os
-import pandas as pd
+import queue
+import threading
 import tkinter as tk
 from tkinter.font import Font
 from tkinter import filedialog, messagebox, ttk
 from config_manager import ConfigManager
-from face_recognition_manager import FaceRecognitionManager
+from face_recognition_manager import FaceRecognitionManager, RecognitionCancelled, list_student_pictures
 from centered_application import ApplicationPosition
+from instrumentation import startup_timer
+from recognition_service import RecognitionServiceClient
 
 class RecognitionWindow:
-    def __init__(self, master, callback=None):
+    # Interval in milliseconds between two checks of the background worker's messages
+    poll_interval = 100
+
+    def __init__(self, master, callback=None, warmup=None):
         self.master = master
         self.callback = callback  # Optional function to run after processing
+        self.warmup = warmup  # Optional ModelWarmup holding the managers with their roster already loaded
 
         # Create a top-level window for face recognition settings
         self.top = tk.Toplevel(self.master)
@@ -23,6 +30,11 @@ class RecognitionWindow:
         # Initialize configuration manager
         self.config_manager = ConfigManager()
 
+        # Messages posted by the background recognition worker, read on the Tk event loop
+        self.messages = queue.Queue()
+        self.face_manager = None
+        self.cancel_event = None
+
         # Set up the UI elements
         self.setup_ui()
         self.top.attributes('-topmost', True)  # Make window always stay on top
@@ -55,13 +67,22 @@ class RecognitionWindow:
         self.process_button = ttk.Button(self.top, text="Process", command=self.process, state="disabled")
         self.process_button.grid(row=3, column=0, columnspan=3, pady=20, sticky='ew')
 
+        # Progress of the running recognition, with the current stage and a way to stop it
+        self.progress_var = tk.DoubleVar(value=0)
+        self.progress_bar = ttk.Progressbar(self.top, variable=self.progress_var, maximum=100)
+        self.progress_bar.grid(row=4, column=0, columnspan=2, padx=(20, 0), sticky='ew')
+        self.cancel_button = ttk.Button(self.top, text="Cancel", command=self.cancel, state="disabled")
+        self.cancel_button.grid(row=4, column=2, padx=(0, 20), sticky='w')
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(self.top, textvariable=self.status_var, font=font).grid(row=5, column=0, columnspan=3, pady=(5, 20))
+
         # Make the middle column expand more to accommodate the entry widget
         self.top.grid_columnconfigure(1, weight=3)
 
     def browse_anchor(self):
         # Open a file dialog to choose an image file, and update UI accordingly
         self.top.attributes('-topmost', False)  # Temporarily make window not stay on top
-        self.anchor_image_path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png")])
+        self.anchor_image_path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png"), ("Video files", "*.mp4 *.mov *.avi *.mkv *.m4v *.webm")])
         self.top.attributes('-topmost', True)  # Restore window topmost status
 
         # Update the entry field and enable the process button if a file is selected
@@ -74,9 +95,8 @@ class RecognitionWindow:
     def load_attributes(self):
         # Load configuration specific to the selected class ID
         try:
-            class_config = self.config_manager.get_class_config(str(self.class_id))
-            self.directory_path, self.file_path = class_config.values()
-            print(self.file_path)
+            self.class_settings = self.config_manager.get_class_settings(str(self.class_id))
+            self.directory_path, self.file_path = self.class_settings.directory_path, self.class_settings.excel_file_path
         except ValueError:
             messagebox.showerror("Configuration Error", "Invalid configuration for the selected class.")
             return False
@@ -84,10 +104,9 @@ class RecognitionWindow:
             return True
 
     def load_file(self):
-        # Load or initialize the DataFrame depending on the file's existence
+        # Without a workbook yet, the class attendance is created from the students' pictures
         if not os.path.isfile(self.file_path):
-            # Initialize a new DataFrame if file doesn't exist
-            return self.initialize_dataframe_from_directory()
+            return self.check_student_pictures()
             
         try:
             #trying to figure out wheter the excel file is already open or not
@@ -96,28 +115,16 @@ class RecognitionWindow:
         except PermissionError:
             messagebox.showerror("PermissionError", "Attendance updated Failed.\nplease close the excel file and try again")
             return False
-    
-        self.df = pd.read_excel(self.file_path, index_col=0)
-        # Uniform formatting for column names
-        self.df.columns = pd.to_datetime(self.df.columns).strftime("%Y-%m-%d")
 
+        # The attendance itself is kept in the attendance store, the workbook is only exported
         return True
 
 
-    def initialize_dataframe_from_directory(self):
-        # Create a DataFrame using image filenames as index
-        file_names = [
-            filename.replace("_", " ")[:filename.rindex(".")].strip().capitalize()
-            for filename in sorted(os.listdir(self.directory_path), key=lambda label: ord(label[0]))
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg'))
-        ]
-
-        if not file_names:
+    def check_student_pictures(self):
+        if not list_student_pictures(self.directory_path):
             messagebox.showerror("FileExistsError", "the students' pictures folder you have provided is either empty or don't contain any pictures at all")
             self.config_manager.delete_class_config(self.class_id)
             return False
-            
-        self.df = pd.DataFrame(index=file_names)
         return True
 
     def process(self):
@@ -131,13 +138,113 @@ class RecognitionWindow:
 
         if not self.load_file(): return
         
-        # Face recognition processing and results handling
-        self.face_manager = FaceRecognitionManager(self.directory_path, self.anchor_image_path, self.file_path)
-        cropped_faces = self.face_manager.crop_faces()
-        results = self.face_manager.compare_faces(cropped_faces)
-        self.face_manager.update_dataframe(results, self.df, self.class_id)
-        
-        
+        # Face recognition processing runs on a background thread so the window stays responsive
+        self.cancel_event = threading.Event()
+        self.process_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        threading.Thread(target=self.run_recognition, daemon=True).start()
+        self.top.after(self.poll_interval, self.poll_messages)
+
+    def create_manager(self, service_url):
+        # Reuse the manager warmed up at startup, its roster is already loaded (the service has its own)
+        face_manager = None
+        if self.warmup is not None and not service_url:
+            self.messages.put(("progress", "Loading the students' pictures", 0, 0))
+            face_manager = self.warmup.take(self.class_id, self.class_settings, self.cancel_event)
+        if face_manager is None:
+            face_manager = FaceRecognitionManager.from_settings(self.class_settings)
+        face_manager.anchor_image_path = self.anchor_image_path
+        face_manager.cancel_event = self.cancel_event
+        face_manager.progress = lambda stage, done, total: self.messages.put(("progress", stage, done, total))
+        return face_manager
+
+    def run_recognition(self):
+        # Runs on the worker thread, never touches the widgets directly
+        service_url = os.environ.get(RecognitionServiceClient.url_env_var)
+        try:
+            self.face_manager = self.create_manager(service_url)
+        except Exception as e:
+            self.messages.put(("error", e))
+            return
+        recorder = self.face_manager.start_run(source="gui", class_id=self.class_id,
+                                               anchor_image_path=self.anchor_image_path)
+        try:
+            if service_url:
+                # The local service has the models and the roster already loaded
+                response = RecognitionServiceClient(service_url).recognize(self.class_id, self.anchor_image_path,
+                                                                           update_attendance=True, export_excel=True)
+                results = response['results']
+                self.face_manager.unrecognized_files = response['unrecognized_files']
+            else:
+                face_encodings = self.face_manager.encode_faces()
+                results, _ = self.face_manager.compare_faces(face_encodings)
+                # The workbook is opened right after, export it now
+                self.face_manager.update_attendance(results, self.class_id, export_excel=True)
+        except RecognitionCancelled:
+            recorder.finish("cancelled")
+            self.messages.put(("cancelled",))
+        except Exception as e:
+            recorder.finish("error", error=f"{type(e).__name__}: {e}")
+            self.messages.put(("error", e))
+        else:
+            recorder.finish("ok", present=sum(result == '✓' for result in results.values()))
+            self.messages.put(("done",))
+        finally:
+            self.face_manager.close()
+
+    def poll_messages(self):
+        # Apply the worker's messages on the Tk main thread
+        try:
+            while True:
+                message = self.messages.get_nowait()
+                if message[0] == "progress":
+                    self.show_progress(*message[1:])
+                else:
+                    self.finish(*message)
+                    return
+        except queue.Empty:
+            pass
+
+        self.top.after(self.poll_interval, self.poll_messages)
+
+    def show_progress(self, stage, done, total):
+        if total:
+            self.progress_bar.config(mode="determinate")
+            self.progress_bar.stop()
+            self.progress_var.set(100 * done / total)
+            self.status_var.set(f"{stage} ({done}/{total})")
+        else:
+            # Stages without a known length just show activity
+            self.progress_bar.config(mode="indeterminate")
+            self.progress_bar.start()
+            self.status_var.set(f"{stage}...")
+
+    def cancel(self):
+        # Ask the worker to stop at the next stage boundary
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state="disabled")
+            self.status_var.set("Cancelling...")
+
+    def finish(self, outcome, error=None):
+        self.progress_bar.stop()
+        self.cancel_button.config(state="disabled")
+        self.process_button.config(state="normal")
+
+        if outcome == "cancelled":
+            self.progress_var.set(0)
+            self.status_var.set("Recognition cancelled.")
+            return
+
+        if outcome == "error":
+            self.status_var.set("")
+            messagebox.showerror("Error", f"Face recognition failed: {error}")
+            return
+
+        if self.face_manager.unrecognized_files:
+            messagebox.showwarning("Warning", "No face was found in these students' pictures:\n" + "\n".join(self.face_manager.unrecognized_files))
+
+        startup_timer.mark("first_result")
         messagebox.showinfo("Success", "Attendance updated successfully.")
         
 
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+
+
+class AnchorResultCache:
+    """On-disk cache of the face boxes and embeddings found in class photos.
+
+    Entries are keyed by the SHA-256 of the photo's content and the detection and encoding settings,
+    so processing the same photo again (after a failed Excel write, or once the roster was fixed) goes
+    straight to matching. The least recently used entries are evicted beyond max_bytes.
+    """
+    # Default location, relative to the working directory
+    directory = os.path.join("cache", "anchor_results")
+    max_bytes = 64 * 1024 * 1024
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or self.directory
+        self.max_bytes = max_bytes or self.max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image_path, settings, chunk_size=1 << 16):
+        """Returns the cache key of the photo's content processed with the given settings."""
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(chunk_size), b''):
+                digest.update(chunk)
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Returns the (face_locations, face_encodings) stored under key, or None."""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                face_locations = [tuple(int(value) for value in box) for box in data['boxes']]
+                face_encodings = list(data['encodings'])
+            os.utime(path)  # the modification time orders the entries for eviction
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return face_locations, face_encodings
+
+    def put(self, key, face_locations, face_encodings):
+        """Stores the results of a photo, then evicts the least recently used entries over max_bytes."""
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as cache_file:
+            np.savez(cache_file,
+                     boxes=np.array(face_locations, dtype=np.int32).reshape(-1, 4),
+                     encodings=np.array(face_encodings, dtype=np.float32).reshape(-1, 128))
+        os.replace(temp_path, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """Returns (path, size, mtime) of every entry, most recently used first."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".npz"): continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # evicted by another process
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2], reverse=True)
+
+    def evict(self):
+        total = 0
+        for path, size, _ in self.entries():
+            total += size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def info(self):
+        entries = self.entries()
+        return {
+            'directory': self.directory,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the class photo result cache.")
+    parser.add_argument('directory', nargs='?', default=None, help="cache folder, cache/anchor_results by default")
+    parser.add_argument('--clear', action='store_true', help="delete every cached result")
+    args = parser.parse_args(argv)
+
+    cache = AnchorResultCache(args.directory)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {cache.directory}")
+    else:
+        print(json.dumps(cache.info(), indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+from quantized_gallery import QuantizedGallery
+
+
+class SharedGallery:
+    """A class gallery published to disk once and attached by any number of processes.
+
+    Every publication is saved to a new version folder, then current.json is replaced atomically to
+    point at it. Attached processes memory-map the arrays, so they share the same pages instead of each
+    holding a copy, and switch to the new version at their next call to current().
+    """
+    manifest_name = "current.json"
+    kept_versions = 2  # the previous version stays for processes still attaching to it
+    # Seconds a version is kept at least, a concurrent publisher may be about to make it the current one
+    min_version_age = 60.0
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, self.manifest_name)
+        self.gallery = None
+        self.info = {}
+        self._signature = None
+
+    def publish(self, gallery, **info):
+        """Saves the gallery as a new version and makes it the current one. Returns the version."""
+        os.makedirs(self.root, exist_ok=True)
+        # Versions sort by time, the random suffix keeps concurrent publishers apart
+        version_path = tempfile.mkdtemp(prefix=f"v{time.time_ns()}_", dir=self.root)
+        os.chmod(version_path, 0o755)  # mkdtemp only lets the owner in, like a regular folder instead
+        gallery.save(version_path)
+        version = os.path.basename(version_path)
+
+        # Each publisher writes its own temporary file, the manifest is replaced atomically
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.root, suffix='.tmp',
+                                         delete=False) as manifest_file:
+            json.dump({'version': version, **info}, manifest_file, ensure_ascii=False)
+        os.chmod(manifest_file.name, 0o644)
+        os.replace(manifest_file.name, self.manifest_path)
+
+        self.remove_old_versions()
+        return version
+
+    def current_version(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as manifest_file:
+                return json.load(manifest_file)['version']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def remove_old_versions(self):
+        """Removes the versions older than the kept ones, except the current one and the recent ones."""
+        current = self.current_version()
+        versions = sorted(name for name in os.listdir(self.root) if name.startswith('v'))
+        for version in versions[:-self.kept_versions]:
+            path = os.path.join(self.root, version)
+            try:
+                if version == current or time.time() - os.path.getmtime(path) < self.min_version_age: continue
+            except FileNotFoundError:
+                continue  # removed by another publisher
+            # Fails on Windows while another process still maps the files, retried at the next publication
+            shutil.rmtree(path, ignore_errors=True)
+
+    def signature(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def current(self):
+        """Returns the current gallery, attaching again only when a newer version was published,
+        or None when nothing was published yet."""
+        signature = self.signature()
+        if signature is not None and signature != self._signature:
+            try:
+                with open(self.manifest_path, encoding='utf-8') as manifest_file:
+                    manifest = json.load(manifest_file)
+                self.gallery = QuantizedGallery.load(os.path.join(self.root, manifest['version']))
+            except (FileNotFoundError, ValueError):
+                return self.gallery  # replaced while attaching, the next call tries again
+            self.info = manifest
+            self._signature = signature
+        return self.gallery
@@ -0,0 +1,230 @@
+import os
+import cv2
+import numpy as np
+from face_detection import box_overlap
+from face_matcher import FaceMatcher
+
+# Extensions of the files treated as video clips instead of class photos
+video_extensions = ('.mp4', '.mov', '.avi', '.mkv', '.m4v', '.webm')
+
+
+def is_video(path):
+    return bool(path) and path.lower().endswith(video_extensions)
+
+
+class FaceTrack:
+    """A face followed across the sampled frames of a clip, with the few encodings taken of it."""
+
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = frame_index
+        self.last_seen = frame_index
+        self.last_encoded = None
+        self.hits = 1
+        self.encodings = []
+
+    @property
+    def centroid(self):
+        return np.mean(self.encodings, axis=0)
+
+    def is_consistent(self, max_spread):
+        """True when all encodings of the track agree, i.e. it followed a single person."""
+        centroid = self.centroid
+        return all(np.linalg.norm(encoding - centroid) <= max_spread for encoding in self.encodings)
+
+    def merge(self, other):
+        """Takes over a track that turned out to follow the same face."""
+        self.box, self.last_seen = other.box, other.last_seen
+        self.hits += other.hits
+        self.encodings.extend(other.encodings)
+        self.last_encoded = other.last_encoded
+
+
+class VideoAttendance:
+    """Collects one embedding per student seen in a short video clip, such as a pan of the classroom.
+
+    Frames are sampled adaptively: often while the camera moves, rarely when the picture is still.
+    Detected faces are tracked across sampled frames by box overlap, once the boxes are moved by the
+    camera's motion between the frames, and a new track whose first encoding is close to a track
+    lost in this frame continues it. Each track is encoded only a few times rather than on every frame.
+    A track counts once it was seen in enough frames and its encodings agree, or when its single
+    encoding clearly matches a student, and its mean embedding is then matched to the roster like a
+    face of a photo.
+    """
+
+    def __init__(self, face_manager, min_interval=0.1, max_interval=1.0, motion_threshold=12.0,
+                 max_encodings_per_track=3, min_hits=2, iou_threshold=0.3, max_missed=3, clear_match=0.75):
+        self.face_manager = face_manager
+        self.min_interval = min_interval  # seconds between sampled frames while the picture moves
+        self.max_interval = max_interval  # seconds between sampled frames while the picture is still
+        self.motion_threshold = motion_threshold  # mean absolute difference of the thumbnails, 0-255
+        self.max_encodings_per_track = max_encodings_per_track
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed  # sampled frames a track may go unseen before it ends
+        # A track seen once still counts when its distance to a student is below this fraction of the tolerance
+        self.clear_match = clear_match
+        self.window = cv2.createHanningWindow(self.thumbnail_size, cv2.CV_32F)
+        self.stats = {}
+
+    thumbnail_size = (64, 36)
+
+    @classmethod
+    def thumbnail(cls, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, cls.thumbnail_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def camera_shift(self, previous_thumbnail, thumbnail, frame_shape):
+        """Returns the (dx, dy) shift of the picture between two sampled frames, in frame pixels,
+        estimated by phase correlation of their thumbnails. (0, 0) when no clear shift is found."""
+        (dx, dy), response = cv2.phaseCorrelate(previous_thumbnail, thumbnail, self.window)
+        if response < 0.1:
+            return 0.0, 0.0
+        return dx * frame_shape[1] / self.thumbnail_size[0], dy * frame_shape[0] / self.thumbnail_size[1]
+
+    @staticmethod
+    def shift_box(box, dx, dy):
+        top, right, bottom, left = box
+        dx, dy = int(round(dx)), int(round(dy))
+        return top + dy, right + dx, bottom + dy, left + dx
+
+    @staticmethod
+    def inside(box, frame_shape, margin=2):
+        top, right, bottom, left = box
+        return top >= margin and left >= margin and bottom <= frame_shape[0] - margin and right <= frame_shape[1] - margin
+
+    def associate(self, tracks, boxes, frame_index):
+        """Assigns the detected boxes to the live tracks by greatest overlap, returns the unmatched boxes."""
+        pairs = sorted(((box_overlap(track.box, box), track_id, index)
+                        for track_id, track in tracks.items() for index, box in enumerate(boxes)), reverse=True)
+        used_tracks, used_boxes = set(), set()
+        for overlap, track_id, index in pairs:
+            if overlap < self.iou_threshold: break
+            if track_id in used_tracks or index in used_boxes: continue
+            track = tracks[track_id]
+            track.box, track.last_seen = boxes[index], frame_index
+            track.hits += 1
+            used_tracks.add(track_id)
+            used_boxes.add(index)
+        return [box for index, box in enumerate(boxes) if index not in used_boxes]
+
+    def continue_tracks(self, live, frame_index):
+        """Merges each track started in this frame into the track unseen in it whose encodings are the
+        closest to its first encoding, when close enough to be the same face."""
+        max_spread = self.face_manager.matcher.tolerance / 2
+        for track in [track for track in live.values() if track.first_seen == frame_index and track.encodings]:
+            candidates = [other for other in live.values() if other.last_seen < frame_index and other.encodings]
+            if not candidates: continue
+            distances = [np.linalg.norm(track.encodings[0] - other.centroid) for other in candidates]
+            best = int(np.argmin(distances))
+            if distances[best] <= max_spread:
+                candidates[best].merge(live.pop(track.track_id))
+
+    def track_faces(self, video_path):
+        """Reads the clip and returns all the face tracks found in it."""
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise FileNotFoundError(f"Cannot open video {video_path}")
+
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+        interval = self.min_interval
+        next_sample, frame_index = 0.0, -1
+        previous_thumbnail = None
+        live, finished = {}, []
+        next_track_id = 0
+        sampled = encoded = 0
+
+        try:
+            while capture.grab():  # grab without decoding, only sampled frames are decoded
+                frame_index += 1
+                if frame_index / fps < next_sample: continue
+
+                ok, frame = capture.retrieve()
+                if not ok: break
+                sampled += 1
+                self.face_manager.report("Reading video", frame_index, total_frames)
+
+                # Sample more often while the camera moves, less when the picture is still
+                thumbnail = self.thumbnail(frame)
+                if previous_thumbnail is not None:
+                    dx, dy = self.camera_shift(previous_thumbnail, thumbnail, frame.shape)
+                    motion = float(np.abs(thumbnail - previous_thumbnail).mean())
+                    # A pan over a plain background barely changes the thumbnail, but it does shift it
+                    if motion > self.motion_threshold or max(abs(dx), abs(dy)) >= frame.shape[1] / 64:
+                        interval = self.min_interval
+                    else:
+                        interval = min(interval * 2, self.max_interval)
+                    # Move the tracks with the camera, faces shift further than their width between samples
+                    for track in live.values():
+                        track.box = self.shift_box(track.box, dx, dy)
+                previous_thumbnail = thumbnail
+                next_sample = frame_index / fps + interval
+
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)  # in place, the frame isn't reused
+                boxes = self.face_manager.backend.detector.locate(rgb_frame)
+                for box in self.associate(live, boxes, sampled):
+                    live[next_track_id] = FaceTrack(next_track_id, box, sampled)
+                    next_track_id += 1
+
+                # Encode only the tracks seen in this frame that still need an encoding, once their
+                # face is whole: a face cut by the edge of a panning frame gives a wrong encoding
+                due = [track for track in live.values() if track.last_seen == sampled
+                       and len(track.encodings) < self.max_encodings_per_track
+                       and (track.last_encoded is None or sampled - track.last_encoded >= 2)
+                       and self.inside(track.box, frame.shape)]
+                if due:
+                    encodings = self.face_manager.backend.encoder.encode(rgb_frame, [track.box for track in due])
+                    for track, encoding in zip(due, encodings):
+                        track.encodings.append(np.asarray(encoding))
+                        track.last_encoded = sampled
+                    encoded += len(encodings)
+                self.continue_tracks(live, sampled)
+
+                lost = [track_id for track_id, track in live.items() if sampled - track.last_seen > self.max_missed]
+                for track_id in lost:
+                    finished.append(live.pop(track_id))
+        finally:
+            capture.release()
+
+        self.stats = {'frames': frame_index + 1, 'sampled_frames': sampled, 'encoded_faces': encoded,
+                      'tracks': len(finished) + len(live)}
+        return finished + list(live.values())
+
+    def encode(self, video_path):
+        """Returns one embedding per confidently tracked face of the clip."""
+        tracks = self.track_faces(video_path)
+        max_spread = self.face_manager.matcher.tolerance / 2
+
+        tracked = [track for track in tracks if track.encodings and track.is_consistent(max_spread)]
+        confirmed = [track for track in tracked if track.hits >= min(self.min_hits, self.stats['sampled_frames'])]
+        # A face seen in a single sample, at the edge of a pan, still counts when it clearly is a student
+        glimpsed = [track for track in tracked if track not in confirmed]
+        if glimpsed:
+            if not self.face_manager.roster_loaded:
+                self.face_manager.load_known_faces()
+            known_faces = self.face_manager.known_faces
+            if known_faces:
+                distances = FaceMatcher.student_distances([track.centroid for track in glimpsed], known_faces)
+                clear = distances.min(axis=1) <= self.clear_match * self.face_manager.matcher.tolerance
+                confirmed += [track for track, is_clear in zip(glimpsed, clear) if is_clear]
+
+        self.stats['confirmed_tracks'] = len(confirmed)
+        return [track.centroid for track in confirmed]
+
+
+# Example usage: python video_attendance.py <students pictures folder> <video>
+if __name__ == "__main__":
+    import sys
+    from face_recognition_manager import FaceRecognitionManager
+
+    if len(sys.argv) != 3:
+        sys.exit("usage: python video_attendance.py <students pictures folder> <video>")
+
+    face_manager = FaceRecognitionManager(sys.argv[1], sys.argv[2], None)
+    video = VideoAttendance(face_manager)
+    results, distances = face_manager.compare_faces(video.encode(sys.argv[2]))
+    print(video.stats)
+    for name, result in results.items():
+        print(f"{result} {name} ({os.path.basename(sys.argv[2])})")
@@ -0,0 +1,275 @@
+"""Watch-folder mode: processes the class photos dropped in each class's drop folder automatically,
+and re-encodes the students' pictures that are added, changed or removed.
+
+Example usage:
+    python watcher.py --class 7A --class 7B
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import threading
+from datetime import date
+from config_manager import ConfigManager
+from attendance_store import AttendanceStore, ExcelExportScheduler
+from face_recognition_manager import FaceRecognitionManager, picture_extensions
+from video_attendance import video_extensions
+
+try:
+    import inotify_simple  # optional, Linux only
+except ImportError:
+    inotify_simple = None
+
+
+class FolderSnapshot:
+    """Signatures (size, mtime) of the matching files of a folder, to tell what changed between two scans."""
+
+    def __init__(self, path, extensions, recursive=False):
+        self.path = path
+        self.extensions = extensions
+        self.recursive = recursive
+        self.files = {}
+
+    def scan(self):
+        files = {}
+        for root, directories, filenames in os.walk(self.path):
+            # Skip hidden folders and the folders the processed photos are moved to
+            directories[:] = [d for d in directories if self.recursive and not d.startswith('.')]
+            for filename in filenames:
+                if not filename.lower().endswith(self.extensions): continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # removed while scanning
+                files[os.path.relpath(path, self.path)] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def changes(self):
+        """Rescans the folder, returns the (added, changed, removed) relative paths since the last scan."""
+        files = self.scan()
+        added = [path for path in files if path not in self.files]
+        changed = [path for path in files if path in self.files and files[path] != self.files[path]]
+        removed = [path for path in self.files if path not in files]
+        self.files = files
+        return added, changed, removed
+
+
+class PollingWatcher:
+    """Fallback watcher: reports every folder as possibly changed after each interval."""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.folders = set()
+
+    def watch(self, folder):
+        self.folders.add(folder)
+
+    def wait(self, stop_event):
+        stop_event.wait(self.interval)
+        return set(self.folders)
+
+
+class InotifyWatcher:
+    """Watcher based on inotify, reports the folders in which something happened."""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.inotify = inotify_simple.INotify()
+        self.flags = (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO |
+                      inotify_simple.flags.MOVED_FROM | inotify_simple.flags.DELETE |
+                      inotify_simple.flags.CREATE)
+        self.folders = {}  # watch descriptor -> watched folder
+
+    def watch(self, folder):
+        # Sub folders (one per student) are watched too, events are reported on the watched folder
+        for root, directories, _ in os.walk(folder):
+            directories[:] = [d for d in directories if not d.startswith('.')]
+            self.folders[self.inotify.add_watch(root, self.flags)] = folder
+
+    def wait(self, stop_event):
+        # The timeout also lets the caller re-check photos that were still being written
+        events = self.inotify.read(timeout=int(self.interval * 1000))
+        return {self.folders[event.wd] for event in events if event.wd in self.folders}
+
+
+class ClassWatch:
+    """A class being watched, with its resident recognition manager and today's merged results."""
+
+    def __init__(self, class_id, settings):
+        self.class_id = class_id
+        self.drop_folder = settings.drop_folder
+        self.face_manager = FaceRecognitionManager.from_settings(settings)
+        self.roster = FolderSnapshot(settings.directory_path, picture_extensions, recursive=True)
+        self.drops = FolderSnapshot(self.drop_folder, picture_extensions + video_extensions)
+        self.pending = {}  # dropped photo -> signature seen at the last scan, processed once it settles
+        self.day, self.results = None, {}
+
+    def start_day(self, day):
+        """Starts merging the results of a new day from the students the store already has present that day,
+        so restarting the watcher during the day doesn't mark absent those missing from the next photo."""
+        store = AttendanceStore.for_excel_file(self.face_manager.file_path)
+        statuses = {name.lower(): status for name, status in
+                    store.statuses(self.class_id, day.strftime(r"%Y-%m-%d")).items()}
+        self.day = day
+        self.results = {name: '✓' for name in self.face_manager.known_faces if statuses.get(name.lower()) == '✓'}
+
+
+class AttendanceWatcher:
+    """Long-running mode keeping the models and embeddings resident between events,
+    so each dropped photo only costs detection and matching."""
+    processed_folder = "processed"
+    failed_folder = "failed"
+
+    def __init__(self, config_manager, class_ids=None, interval=2.0, use_inotify=True, export_delay=60.0):
+        self.config_manager = config_manager
+        # Photos often arrive in bursts, the workbook is rewritten once per burst rather than per photo
+        self.exporter = ExcelExportScheduler(export_delay)
+        self.class_ids = class_ids
+        self.watcher = InotifyWatcher(interval) if use_inotify and inotify_simple else PollingWatcher(interval)
+        self.classes = {}
+        self.stop_event = threading.Event()
+
+    def setup(self):
+        """Loads the roster of every class that has a drop folder and starts watching the folders."""
+        for class_id in self.class_ids or self.config_manager.load_config():
+            try:
+                settings = self.config_manager.get_class_settings(class_id)
+            except ValueError as e:
+                print(e)
+                continue
+            if not settings.drop_folder:
+                print(f"Class ID {class_id} has no drop folder, skipped.")
+                continue
+
+            os.makedirs(settings.drop_folder, exist_ok=True)
+            watch = ClassWatch(class_id, settings)
+            watch.face_manager.load_known_faces()
+            watch.roster.changes()
+            # Photos dropped while the watcher was not running are processed too
+            watch.pending = {path: None for path in watch.drops.scan()}
+            self.classes[class_id] = watch
+            self.watcher.watch(settings.directory_path)
+            self.watcher.watch(settings.drop_folder)
+            print(f"Watching class {class_id}: {settings.drop_folder}")
+
+    def refresh_roster(self, watch):
+        """Re-encodes only the students' pictures that were added or changed, and drops the removed ones."""
+        added, changed, removed = watch.roster.changes()
+        if added or changed or removed:
+            # The embedding cache turns this into an incremental re-encoding
+            watch.face_manager.load_known_faces()
+            print(f"Class {watch.class_id}: roster updated "
+                  f"({len(added)} added, {len(changed)} changed, {len(removed)} removed)")
+            if isinstance(self.watcher, InotifyWatcher):
+                self.watcher.watch(watch.roster.path)  # new per-student folders
+        return added, changed, removed
+
+    def process_photo(self, watch, relative_path):
+        """Recognizes the students in a dropped photo and updates today's attendance."""
+        path = os.path.join(watch.drop_folder, relative_path)
+        face_manager = watch.face_manager
+        face_manager.anchor_image_path = path
+        recorder = face_manager.start_run(source="watcher", class_id=watch.class_id, anchor_image_path=path)
+
+        try:
+            today = date.today()
+            if watch.day != today:
+                watch.start_day(today)
+            face_encodings = face_manager.encode_faces()
+            results, _ = face_manager.compare_faces(face_encodings)
+            # A student is present if recognized in any of today's photos
+            for name, result in results.items():
+                if result == '✓' or name not in watch.results:
+                    watch.results[name] = result
+            face_manager.update_attendance(watch.results, watch.class_id)
+            self.exporter.schedule(face_manager.file_path, watch.class_id)
+        except Exception as e:
+            recorder.finish("error", error=f"{type(e).__name__}: {e}")
+            print(f"Class {watch.class_id}: {relative_path} failed, {e}")
+            self.move(watch, relative_path, self.failed_folder)
+            return None
+
+        present = sum(result == '✓' for result in results.values())
+        recorder.finish("ok", present=present)
+        print(f"Class {watch.class_id}: {relative_path} processed, {present} recognized")
+        self.move(watch, relative_path, self.processed_folder)
+        return results
+
+    def move(self, watch, relative_path, folder):
+        destination = os.path.join(watch.drop_folder, folder)
+        os.makedirs(destination, exist_ok=True)
+        name, extension = os.path.splitext(os.path.basename(relative_path))
+        target = os.path.join(destination, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}{extension}")
+        shutil.move(os.path.join(watch.drop_folder, relative_path), target)
+
+    def process_drops(self, watch):
+        """Processes the dropped photos whose size and mtime did not change since the previous scan,
+        so photos still being copied are left for the next round."""
+        files = watch.drops.scan()
+        watch.drops.files = files
+        processed = []
+        for path, signature in sorted(files.items()):
+            if watch.pending.get(path, False) == signature:
+                self.process_photo(watch, path)
+                processed.append(path)
+                watch.pending.pop(path, None)
+            else:
+                watch.pending[path] = signature
+        for path in [path for path in watch.pending if path not in files]:
+            del watch.pending[path]
+        return processed
+
+    def run_once(self, changed_folders=None):
+        """Handles one round of events. Without changed_folders every folder is checked."""
+        for watch in self.classes.values():
+            if changed_folders is None or watch.roster.path in changed_folders:
+                self.refresh_roster(watch)
+            # Dropped photos are checked every round, pending ones must be seen twice unchanged
+            if changed_folders is None or watch.drop_folder in changed_folders or watch.pending:
+                self.process_drops(watch)
+
+    def run(self):
+        self.setup()
+        if not self.classes:
+            print("No class to watch, set a drop folder for the classes first.")
+            return
+        print(f"Using {type(self.watcher).__name__}, press Ctrl+C to stop.")
+        try:
+            while not self.stop_event.is_set():
+                self.run_once(self.watcher.wait(self.stop_event))
+        finally:
+            self.exporter.flush()
+            for watch in self.classes.values():
+                watch.face_manager.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Watch the classes' drop folders and process new class photos.")
+    parser.add_argument('--class', dest='class_ids', action='append', default=None,
+                        help="class ID to watch, all classes with a drop folder by default")
+    parser.add_argument('--config', default='app_config.json', help="path to the configuration file")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between two checks of the folders")
+    parser.add_argument('--polling', action='store_true', help="poll the folders even when inotify is available")
+    parser.add_argument('--export-delay', type=float, default=60.0,
+                        help="seconds between a class's photo and the export of its Excel sheet")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    watcher = AttendanceWatcher(ConfigManager(args.config), args.class_ids, args.interval, not args.polling,
+                                args.export_delay)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())